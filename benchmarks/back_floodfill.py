@@ -0,0 +1,92 @@
+"""
+Compare the flood fill engines of `Back` on speed and check they find the
+same background masks.
+
+Synthetic images (see `benchmarks.synthetic`) are resized to each number of
+rows, then the flood fill of each engine runs on every resized image. Only
+the filling of the edges, which is what differs between engines, is timed.
+The exit status is 1 if any mask differs from the one of the 'label'
+engine.
+
+Usage:
+    python -m benchmarks.back_floodfill --rows 100 300 1000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import skimage.morphology as skm
+
+from color_extractor import Back, Resize
+
+from . import synthetic
+
+ENGINES = ('label', 'flood')
+
+
+def edges(img):
+    """Return the thinned edges of `img` the engines start from"""
+    e = skm.skeletonize(Back._scharr(img) > 0.05)
+    e[0, :] = e[-1, :] = True
+    e[:, 0] = e[:, -1] = True
+    return e
+
+
+def run(engine, images, repeat):
+    """
+    Return the flood fill masks of `images` and the time per image spent
+    filling the edges. Edge detection and opening are common to all engines
+    and not timed.
+    """
+    back = Back({'floodfill': engine})
+    masks = [back._floodfill(i) for i in images]
+
+    fill = {'label': Back._fill_label, 'flood': Back._fill_flood}[engine]
+    thinned = [edges(i) for i in images]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for e in thinned:
+            fill(e.copy())
+    elapsed = (time.perf_counter() - start) / (repeat * len(images))
+
+    return masks, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', nargs='+', type=int,
+                        default=[100, 300, 1000])
+    parser.add_argument('--images', type=int, default=5,
+                        help='images per background and skin')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    originals = [i for _, i in synthetic.images(rng, [(1200, 900)],
+                                                args.images)]
+
+    print('{:>6} {:>12} {:>12} {:>8} {:>10}'.format(
+        'rows', 'label (ms)', 'flood (ms)', 'speedup', 'agreement'))
+    disagree = False
+    for rows in args.rows:
+        resize = Resize({'rows': rows})
+        images = [resize.get(i) for i in originals]
+        results = {e: run(e, images, args.repeat) for e in ENGINES}
+
+        reference, label_time = results['label']
+        masks, flood_time = results['flood']
+        same = np.mean([np.array_equal(m, r)
+                        for m, r in zip(masks, reference)])
+        disagree |= same < 1
+        print('{:>6} {:>12.2f} {:>12.2f} {:>7.1f}x {:>10.3f}'.format(
+            rows, label_time * 1000, flood_time * 1000,
+            label_time / flood_time, same))
+
+    if disagree:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the clustering engines of `Cluster` on throughput and on the
+agreement of the color tags they give.
+
+All images are decoded before timing. Each engine then runs the complete
+`ImageToColor` pipeline over all images, the other settings being the same.
+Tags given by each engine are compared against the ones of the reference
+engine ('kmeans' unless changed with `--reference`).
+
+Usage:
+    python -m benchmarks.cluster_engines color_names.npz images/*.jpg
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from skimage.color import gray2rgb
+from skimage.io import imread
+
+from color_extractor import ImageToColor
+
+
+def load_images(uris):
+    images = []
+    for uri in uris:
+        i = imread(uri)
+        images.append(gray2rgb(i) if len(i.shape) == 2 else i[:, :, :3])
+    return images
+
+
+def run(engine, images, samples, labels, settings):
+    s = dict(settings)
+    s['cluster'] = dict(s.get('cluster', {}), algorithm=engine)
+    image_to_color = ImageToColor(samples, labels, s)
+
+    tags, latencies = [], []
+    for img in images:
+        start = time.perf_counter()
+        tags.append(set(image_to_color.get(img)))
+        latencies.append(time.perf_counter() - start)
+
+    return tags, np.array(latencies)
+
+
+def agreement(tags, reference):
+    exact = np.mean([t == r for t, r in zip(tags, reference)])
+    jaccard = np.mean([len(t & r) / max(len(t | r), 1)
+                       for t, r in zip(tags, reference)])
+    return exact, jaccard
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('npz', help='npz archive with samples and labels')
+    parser.add_argument('images', nargs='+', help='images to process')
+    parser.add_argument('--engines', nargs='+',
+                        default=['kmeans', 'median_cut'])
+    parser.add_argument('--reference', default='kmeans')
+    parser.add_argument('--settings', help='JSON settings of the pipeline')
+    args = parser.parse_args()
+
+    npz = np.load(args.npz)
+    settings = {}
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
+
+    images = load_images(args.images)
+    results = {e: run(e, images, npz['samples'], npz['labels'], settings)
+               for e in args.engines}
+
+    reference = results[args.reference][0]
+    print('{:<12} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'engine', 'img/s', 'p50 (ms)', 'p95 (ms)', 'exact', 'jaccard'))
+    for e, (tags, latencies) in results.items():
+        exact, jaccard = agreement(tags, reference)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print('{:<12} {:>10.1f} {:>10.1f} {:>10.1f} {:>8.3f} {:>8.3f}'.format(
+            e, len(latencies) / latencies.sum(), p50, p95, exact, jaccard))
+
+
+if __name__ == '__main__':
+    main()
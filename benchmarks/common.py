@@ -0,0 +1,41 @@
+"""
+Scaffolding shared by the benchmarks: reporting checks, parsing the size of
+images from the command line and running the command line tool.
+"""
+import os
+import shlex
+import sys
+
+# The command line tool of this repository.
+CLI = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                   'color-extractor')
+
+
+def check(name, ok, details=''):
+    """Print whether the check `name` passed, with `details`. Return `ok`."""
+    print('{:<44} {}{}'.format(name, 'ok' if ok else 'FAIL',
+                                ' ' + details if details else ''))
+    return ok
+
+
+def parse_size(s):
+    """Return the `(rows, cols)` of a size given as ROWSxCOLS"""
+    rows, cols = s.split('x')
+    return int(rows), int(cols)
+
+
+def add_cli_argument(parser):
+    """Add the option setting the command running the CLI to `parser`"""
+    parser.add_argument('--cli-command', default=None,
+                        help='command running the CLI (default: the '
+                        'color-extractor script with this interpreter)')
+
+
+def cli_command(args, python=None):
+    """
+    Return the command running the CLI: the one given in `args`, or the
+    color-extractor script run by `python`, this interpreter by default.
+    """
+    if args.cli_command:
+        return shlex.split(args.cli_command)
+    return (python or [sys.executable]) + [CLI]
@@ -0,0 +1,152 @@
+"""
+Measure what writing the intermediate images costs `FromFile.get`, for each
+way of writing them, along with the space they take per image. The time
+spent debugging in `get`, as measured by the 'profile' setting, is reported
+with the latency of `get` and the time taken to flush what was left to write
+in the background.
+
+Synthetic JPEG pictures (see `benchmarks.synthetic`) are processed without
+debugging, then with the intermediate images written as JPEG files or npz
+archives, before returning or from a background thread, and sampled. The
+exit status is 1 if an npz archive doesn't give back the images returned by
+`ImageToColor`, if images written in the background are missing once
+flushed, or if errors writing them aren't raised when writing before
+returning and counted otherwise.
+
+Usage:
+    python -m benchmarks.debug --images 40 --size 600x450
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from skimage.io import imsave
+
+from color_extractor import DebugSink, FromFile, ImageToColor
+from color_extractor.timing import Histogram
+
+from . import synthetic
+from .common import check, parse_size
+
+
+def run(samples, labels, settings, paths):
+    """
+    Return the latencies of `FromFile.get`, the times spent debugging in it
+    and the time to flush.
+    """
+    profile = Histogram()
+    f = FromFile(samples, labels, dict(settings, profile=profile))
+    latencies = []
+    for p in paths:
+        start = time.perf_counter()
+        f.get(p)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    f.flush()
+    flush = time.perf_counter() - start
+    return latencies, profile.percentiles((50, 95)).get('time.debug'), flush
+
+
+def size(directory):
+    return sum(os.path.getsize(os.path.join(directory, f))
+               for f in os.listdir(directory))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--size', default='600x450', type=parse_size,
+                        help='size of the images, as ROWSxCOLS')
+    parser.add_argument('--sample', type=int, default=10,
+                        help='write 1 image out of this many when sampling')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    rows, cols = args.size
+    settings = {'cluster': {'random_state': args.seed}}
+    modes = (
+        ('off', None),
+        ('jpeg', {}),
+        ('npz', {'debug.format': 'npz'}),
+        ('jpeg async', {'debug.max_pending': args.images}),
+        ('npz async', {'debug.format': 'npz',
+                       'debug.max_pending': args.images}),
+        ('npz 1/{}'.format(args.sample), {'debug.format': 'npz',
+                                          'debug.sample': args.sample}),
+    )
+    ok = True
+
+    with tempfile.TemporaryDirectory() as d:
+        paths = []
+        for i, (_, img) in enumerate(synthetic.images(
+                rng, [(rows, cols)], max(args.images // 4, 1))):
+            paths.append(os.path.join(d, 'image{}.jpg'.format(i)))
+            imsave(paths[-1], img, quality=90)
+
+        print('{:<12} {:>10} {:>12} {:>12} {:>10} {:>10}'.format(
+            'debug', 'get p50', 'debug p50', 'debug p95', 'flush',
+            'KB/image'))
+        for name, s in modes:
+            out = os.path.join(d, name.replace(' ', '-').replace('/', '-'))
+            os.mkdir(out)
+            s = settings if s is None else dict(settings, debug=out, **s)
+            latencies, debug, flush = run(samples, labels, s, paths)
+            if debug is None:
+                debug = (0, 0)
+            written = len(os.listdir(out))
+            per_image = 1 if s.get('debug.format') == 'npz' else 4
+            print('{:<12} {:>8.1f}ms {:>10.2f}ms {:>10.2f}ms {:>8.1f}ms '
+                  '{:>10.1f}'.format(
+                      name, np.median(latencies) * 1000, debug[0] * 1000,
+                      debug[1] * 1000, flush * 1000,
+                      size(out) / 1024 / max(written / per_image, 1)))
+
+            if name == 'jpeg async':
+                ok &= check('background JPEG files written',
+                            written == 4 * len(paths))
+
+        # The archives give back what `ImageToColor` returns.
+        i = ImageToColor(samples, labels, dict(settings, debug={}))
+        img = np.asarray(FromFile(samples, labels)._read(paths[0]))
+        _, imgs = i.get(img)
+        name = os.path.splitext(os.path.basename(paths[0]))[0]
+        stored = DebugSink.load(os.path.join(d, 'npz-async', name + '.npz'))
+        ok &= check('npz masks', all(np.array_equal(stored[k], imgs[k])
+                                     for k in ('back', 'skin')))
+        ok &= check('npz images', all(
+            np.abs(stored[k] / 255. - imgs[k]).max() <= 1 / 255.
+            for k in ('resized', 'clusters')))
+        ok &= check('npz sampled', len(os.listdir(os.path.join(
+            d, 'npz-1-{}'.format(args.sample)))) ==
+            len(range(0, len(paths), args.sample)))
+
+        # Writing to a directory that doesn't exist.
+        missing = dict(settings, debug=os.path.join(d, 'missing'))
+        try:
+            FromFile(samples, labels, missing).get(paths[0])
+            ok &= check('errors raised', False)
+        except OSError:
+            ok &= check('errors raised', True)
+        f = FromFile(samples, labels, dict(missing, **{
+            'debug.format': 'npz', 'debug.max_pending': len(paths)}))
+        stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+        try:
+            for p in paths:
+                f.get(p)
+            f.flush()
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        ok &= check('background errors counted',
+                    f._debug.stats()['errors'] == len(paths))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
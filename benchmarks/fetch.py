@@ -0,0 +1,314 @@
+"""
+Check the HTTP fetcher against a local stand-in server and compare its
+throughput to sequential `urlopen` calls.
+
+The server runs in this process on an ephemeral port and serves synthetic
+JPEG images (see `benchmarks.synthetic`) after an artificial latency. Some
+paths answer with chunked bodies, redirections, transient 503 errors, 404
+errors, malformed responses or too slowly, to exercise the fetcher. The
+server also acts as an HTTP proxy, and a host waiting for its connections
+must not hold up the others. `FromFile`, `FromJson` and
+the CLI are then run on the URLs of the images and must find the same
+colors as on local copies. The exit status is 1 if any check fails.
+
+Usage:
+    python -m benchmarks.fetch --images 32 --latency 0.05
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from urllib.request import urlopen
+
+import numpy as np
+from skimage.io import imsave
+
+from color_extractor import FetchException, FromFile, FromJson
+from color_extractor.fetch import Fetcher
+
+from . import synthetic
+from .common import add_cli_argument, check, cli_command
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Serve `images`, a list of JPEG encoded images, under `/img/<i>.jpg`
+    after waiting `latency` seconds. Also serves them under `/chunked/`
+    with a chunked body, under `/redirect/` through a redirection and under
+    `/flaky/` failing with a 503 error the first time. `/slow.jpg` never
+    answers in time, `/malformed.jpg` answers with a malformed status line
+    and anything else is a 404 error. Requests for absolute URLs, as sent to
+    a proxy, are served as if they were for their path.
+    """
+    daemon_threads = True
+
+    def __init__(self, images, latency):
+        super(Server, self).__init__(('127.0.0.1', 0), _Handler)
+        self.images = images
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self.proxied = 0
+        # Requests being answered, and the most at once.
+        self.active = 0
+        self.peak = 0
+        self.failed = set()
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on `/slow.jpg` when they time out.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(Server, self).handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(_Handler, self).setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        s = self.server
+        with s.lock:
+            s.active += 1
+            s.peak = max(s.peak, s.active)
+        try:
+            self._get()
+        finally:
+            with s.lock:
+                s.active -= 1
+
+    def _get(self):
+        s = self.server
+        path = self.path
+        with s.lock:
+            s.requests += 1
+            if not path.startswith('/'):
+                s.proxied += 1
+                path = '/' + path.split('/', 3)[3]
+        time.sleep(s.latency)
+
+        kind, _, name = path[1:].partition('/')
+        if path == '/slow.jpg':
+            time.sleep(10)
+            return self._send(200, b'')
+        if path == '/malformed.jpg':
+            self.wfile.write(b'HTTP/1.1 ok\r\n\r\n')
+            self.close_connection = True
+            return
+
+        try:
+            data = s.images[int(name.split('.')[0])]
+        except (ValueError, IndexError):
+            return self._send(404, b'Not found')
+
+        if kind == 'img':
+            self._send(200, data)
+        elif kind == 'chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(data), 1000):
+                chunk = data[i:i + 1000]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        elif kind == 'redirect':
+            self.send_response(302)
+            self.send_header('Location', '/img/' + name)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif kind == 'flaky':
+            with s.lock:
+                failed = path in s.failed
+                s.failed.add(path)
+            self._send(200, data) if failed else self._send(503, b'Busy')
+        else:
+            self._send(404, b'Not found')
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def encode(img):
+    f = BytesIO()
+    imsave(f, img, format='jpeg', quality=90)
+    return f.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the server waits before answering')
+    parser.add_argument('--seed', type=int, default=0)
+    add_cli_argument(parser)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    images = [synthetic.image(rng, 300, 240, synthetic.BACKGROUNDS[i % 2])
+              for i in range(args.images)]
+    data = [encode(i) for i in images]
+
+    server = Server(data, args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [server.url('/img/{}.jpg'.format(i)) for i in range(len(data))]
+    ok = True
+
+    fetcher = Fetcher(max_per_host=8, timeout=0.5, retries=1, backoff=0.1)
+    ok &= check('body', fetcher.get(urls[0]) == data[0])
+    ok &= check('chunked body',
+                fetcher.get(server.url('/chunked/1.jpg')) == data[1])
+    ok &= check('redirection',
+                fetcher.get(server.url('/redirect/2.jpg')) == data[2])
+    ok &= check('retry after 503',
+                fetcher.get(server.url('/flaky/3.jpg')) == data[3])
+
+    start = time.perf_counter()
+    try:
+        fetcher.get(server.url('/missing.jpg'))
+        ok &= check('404 fails without retry', False)
+    except FetchException as e:
+        ok &= check('404 fails without retry',
+                    time.perf_counter() - start < 0.1 + 2 * args.latency,
+                    str(e))
+
+    start = time.perf_counter()
+    try:
+        fetcher.get(server.url('/slow.jpg'))
+        ok &= check('timeout', False)
+    except FetchException as e:
+        elapsed = time.perf_counter() - start
+        ok &= check('timeout', elapsed < 2, '{:.2f}s'.format(elapsed))
+
+    start = time.perf_counter()
+    try:
+        fetcher.get(server.url('/malformed.jpg'))
+        ok &= check('malformed response retried', False)
+    except FetchException as e:
+        # Retried once, after the backoff.
+        ok &= check('malformed response retried', e.retry and
+                    time.perf_counter() - start >= 0.1, str(e))
+
+    server.connections = 0
+    for u in urls[:8]:
+        fetcher.get(u)
+    ok &= check('connection reused', server.connections <= 1,
+                '{} connection(s) for 8 requests'.format(server.connections))
+
+    start = time.perf_counter()
+    for u in urls:
+        urlopen(u).read()
+    sequential = time.perf_counter() - start
+
+    server.connections = 0
+    start = time.perf_counter()
+    bodies = [f.result() for f in [fetcher.submit(u) for u in urls]]
+    concurrent = time.perf_counter() - start
+    ok &= check('concurrent downloads', bodies == data,
+                '{:.1f} img/s, {:.1f} img/s with urlopen, {} '
+                'connection(s)'.format(len(urls) / concurrent,
+                                       len(urls) / sequential,
+                                       server.connections))
+    fetcher.close()
+
+    # Idle connections are capped, then closed once they expire.
+    fetcher = Fetcher(max_idle=2, idle_timeout=0.5)
+    for f in [fetcher.submit(u) for u in urls[:8]]:
+        f.result()
+    idle = len(fetcher._idle)
+    time.sleep(1)
+    ok &= check('idle connections capped and expired',
+                idle <= 2 and not fetcher._idle,
+                '{} idle after 8 requests, {} later'.format(
+                    idle, len(fetcher._idle)))
+    fetcher.close()
+
+    # Requests waiting for their host must leave the connections they don't
+    # use to the other hosts.
+    fetcher = Fetcher(max_connections=2, max_per_host=1)
+    busy = [fetcher.submit(u) for u in urls[:8]]
+    start = time.perf_counter()
+    other = 'http://localhost:{}/img/0.jpg'.format(server.server_address[1])
+    fetcher.submit(other).result()
+    elapsed = time.perf_counter() - start
+    for f in busy:
+        f.result()
+    fetcher.close()
+    ok &= check('busy host does not hold up others',
+                elapsed < 3 * args.latency + 0.1,
+                '{:.2f}s for 1 request after 8'.format(elapsed))
+
+    # A host that doesn't resolve can only be reached through the proxy.
+    os.environ['http_proxy'] = server.url('')
+    try:
+        fetcher = Fetcher(timeout=2)
+        body = fetcher.get('http://images.invalid/img/4.jpg')
+        ok &= check('HTTP proxy honored',
+                    body == data[4] and server.proxied == 1)
+    except FetchException as e:
+        ok &= check('HTTP proxy honored', False, str(e))
+    finally:
+        del os.environ['http_proxy']
+        fetcher.close()
+
+    with tempfile.TemporaryDirectory() as d:
+        files = [os.path.join(d, '{}.jpg'.format(i)) for i in range(len(data))]
+        for f, b in zip(files, data):
+            with open(f, 'wb') as out:
+                out.write(b)
+
+        settings = {'cluster': {'random_state': args.seed}}
+        from_file = FromFile(samples, labels, settings)
+        local = [sorted(from_file.get(f)) for f in files]
+
+        remote = [sorted(c) for _, c in from_file.imap(urls)]
+        ok &= check('FromFile.imap on URLs', remote == local)
+
+        records = [{'image': u} for u in urls]
+        out = StringIO()
+        FromJson('image', samples, labels,
+                 settings=dict(settings, workers=4)).get(
+                     StringIO(json.dumps(records)), out)
+        tags = [sorted(r['_color_tags']) for r in json.loads(out.getvalue())]
+        ok &= check('FromJson on URLs', tags == local)
+
+        npz = os.path.join(d, 'names.npz')
+        np.savez(npz, samples=samples, labels=labels)
+        settings_file = os.path.join(d, 'settings.json')
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f)
+        command = cli_command(args)
+        server.peak = 0
+        output = subprocess.run(command + ['-s', settings_file, npz] + urls,
+                                stdout=subprocess.PIPE, check=True).stdout
+        tags = [sorted(l.split(',')) if l else []
+                for l in output.decode('utf-8').splitlines()]
+        ok &= check('CLI on URLs', tags == local)
+        ok &= check('CLI downloads overlap', server.peak > 1,
+                    'up to {} at once'.format(server.peak))
+
+    server.shutdown()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Compare the ways `FromJson` enriches a feed: re-encoding the JSON token by
+token, copying its text through, and reading it as JSON Lines.
+
+A feed of `--records` product records, with nested objects, numbers, escapes
+and non-ASCII text, is written as a JSON array and as JSON Lines. Its images
+are a few small synthetic JPEG files (see `benchmarks.synthetic`) whose
+results are cached beforehand and whose colors are named through a lookup
+table, so that the time measured is mostly the one spent reading and writing
+JSON. The exit status is 1 if the modes don't produce the same records and
+colors, or if the text copied through differs from the input other than by
+the colors added.
+
+Usage:
+    python -m benchmarks.from_json --records 50000
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+from skimage.io import imsave
+
+from color_extractor import FromJson
+
+from . import synthetic
+from .common import check
+
+
+def feed(rng, n, images):
+    """Return `n` product records using the paths of `images`"""
+    records = []
+    for i in range(n):
+        records.append({
+            'objectID': str(i),
+            'name': 'Robe été n°{} "{}"'.format(i, i % 7),
+            'price': round(float(rng.uniform(1, 500)), 2),
+            'stock': int(rng.randint(0, 100)),
+            'tags': ['summer', 'sale'] if i % 2 else [],
+            'image': images[i % len(images)],
+            'meta': {'url': 'https://shop.example/p/{}'.format(i),
+                     'ratio': None, 'new': bool(i % 3)},
+        })
+    return records
+
+
+def run(images, path):
+    """Enrich the file at `path`, return the output and the time taken"""
+    out = io.StringIO()
+    start = time.perf_counter()
+    with open(path) as f:
+        images.get(f, out)
+    return out.getvalue(), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    ok = True
+
+    with tempfile.TemporaryDirectory() as d:
+        paths = []
+        for i, (_, img) in enumerate(synthetic.images(
+                rng, [(60, 45)], max(args.images // 4, 1))):
+            paths.append(os.path.join(d, 'image{}.jpg'.format(i)))
+            imsave(paths[-1], img, quality=90)
+
+        records = feed(rng, args.records, paths)
+        array = os.path.join(d, 'feed.json')
+        with open(array, 'w') as f:
+            # Escaped slashes, as some exporters write them.
+            f.write(json.dumps(records, indent=1).replace('/', '\\/'))
+        lines = os.path.join(d, 'feed.jsonl')
+        with open(lines, 'w') as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+
+        settings = {'cache': os.path.join(d, 'cache.sqlite'),
+                    'cluster': {'random_state': args.seed},
+                    'name': {'lut': True, 'lut.path': os.path.join(d, 'lut')},
+                    'name_batch': 256}
+        modes = (
+            ('tokens', array, {'passthrough': False}),
+            ('passthrough', array, {}),
+            ('lines', lines, {'lines': True}),
+        )
+        # Fill the cache.
+        FromJson('image', samples, labels, settings=settings).get(
+            io.StringIO(json.dumps(records[:len(paths)])), io.StringIO())
+
+        outputs = {}
+        print('{:<12} {:>10} {:>12}'.format('mode', 'time (s)', 'records/s'))
+        for name, path, s in modes:
+            j = FromJson('image', samples, labels,
+                         settings=dict(settings, **s))
+            output, elapsed = run(j, path)
+            outputs[name] = output
+            print('{:<12} {:>10.2f} {:>12.0f}'.format(
+                name, elapsed, args.records / elapsed))
+
+        with open(array) as f:
+            text = f.read()
+
+    tokens = json.loads(outputs['tokens'])
+    ok &= check('records enriched',
+                len(tokens) == args.records and
+                all(r['_color_tags'] for r in tokens))
+    ok &= check('passthrough matches tokens',
+                json.loads(outputs['passthrough']) == tokens)
+    ok &= check('lines match tokens',
+                [json.loads(l) for l in outputs['lines'].splitlines()] ==
+                tokens)
+
+    # Removing the colors must give back the input as it was.
+    stripped = re.sub(r',"_color_tags":\[[^\]]*\]', '', outputs['passthrough'])
+    ok &= check('passthrough copies the input', stripped == text)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
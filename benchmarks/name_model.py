@@ -0,0 +1,114 @@
+"""
+Compare building `Name` from samples and labels to opening a model saved
+with `Name.save`, on boot time and private memory per worker process, and
+check both name colors the same way.
+
+Synthetic color samples (see `benchmarks.synthetic`) are saved as an npz
+archive and as a model. Each of `--workers` processes then builds its `Name`
+from the archive and from the model, reporting the time taken and the
+memory it allocated privately, i.e. not shared with the other workers
+(Linux only). The exit status is 1 if the opened model names random colors
+differently from the fitted one, or if its arrays are not memory-mapped.
+
+Usage:
+    python -m benchmarks.name_model --samples 100000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from color_extractor import Name
+
+from . import synthetic
+
+
+def private_memory():
+    """Return the memory mapped privately by this process, in bytes"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return float('nan')
+
+    kb = 0
+    for l in lines:
+        if l.startswith(('Private_Clean:', 'Private_Dirty:')):
+            kb += int(l.split()[1])
+    return kb * 1024
+
+
+def boot(args):
+    """Build a `Name` as a worker would, return the time and memory taken"""
+    npz, model, settings = args
+    before = private_memory()
+    start = time.perf_counter()
+    if model is None:
+        f = np.load(npz)
+        name = Name(f['samples'], f['labels'], settings)
+    else:
+        name = Name(None, None, dict(settings, model=model))
+    elapsed = time.perf_counter() - start
+
+    # Touch the whole model as naming colors would.
+    name.get_many(np.random.RandomState(0).uniform(0, 1, (1000, 3)))
+    return elapsed, private_memory() - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lut', action='store_true',
+                        help='build the lookup table of `Name`')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng, args.samples)
+    settings = {'lut': args.lut}
+    colors = rng.uniform(0, 1, (10000, 3))
+    failed = False
+
+    with tempfile.TemporaryDirectory() as d:
+        npz = os.path.join(d, 'names.npz')
+        np.savez(npz, samples=samples, labels=labels)
+        model = os.path.join(d, 'model')
+        fitted = Name(samples, labels, settings)
+        fitted.save(model)
+
+        opened = Name(None, None, dict(settings, model=model))
+        same = fitted.get_many(colors) == opened.get_many(colors)
+        failed |= not same
+        print('same names: {}'.format(same))
+
+        arrays = [opened._samples, opened._classifier._fit_X]
+        if args.lut:
+            arrays.append(opened._lut)
+        mapped = all(isinstance(a, np.memmap) for a in arrays)
+        failed |= not mapped
+        print('memory-mapped: {}'.format(mapped))
+
+        print('{:<8} {:>12} {:>12} {:>22}'.format(
+            '', 'boot p50', 'boot max', 'private MB/worker p50'))
+        with multiprocessing.Pool(args.workers) as pool:
+            for source, m in (('npz', None), ('model', model)):
+                runs = pool.map(boot, [(npz, m, settings)] * args.workers,
+                                chunksize=1)
+                times = [t for t, _ in runs]
+                memory = [b / 2 ** 20 for _, b in runs]
+                print('{:<8} {:>10.1f}ms {:>10.1f}ms {:>22.1f}'.format(
+                    source, statistics.median(times) * 1000,
+                    max(times) * 1000, statistics.median(memory)))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the precisions of `ImageToColor` on speed, peak memory and on the
+agreement of the color tags they give.
+
+Synthetic images (see `benchmarks.synthetic`) are processed by the complete
+pipeline with each precision, for each number of rows. Tags are compared to
+the ones found with 'float64'. The exit status is 1 if the share of images
+getting exactly the same tags is below `--min-agreement` for any precision.
+
+Usage:
+    python -m benchmarks.precision --rows 100 300 1000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from color_extractor import ImageToColor
+
+from . import synthetic
+from .cluster_engines import agreement
+from .common import parse_size
+
+PRECISIONS = ('float64', 'float32', 'uint8')
+
+
+def run(precision, rows, images, samples, labels, seed):
+    """
+    Return the tags of `images`, the time per image and the peak memory
+    allocated while processing an image.
+    """
+    image_to_color = ImageToColor(samples, labels, {
+        'precision': precision,
+        'resize': {'rows': rows},
+        'cluster': {'random_state': seed},
+    })
+
+    start = time.perf_counter()
+    tags = [set(image_to_color.get(i)) for i in images]
+    elapsed = (time.perf_counter() - start) / len(images)
+
+    peak = 0
+    for i in images:
+        tracemalloc.start()
+        image_to_color.get(i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return tags, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', nargs='+', type=int,
+                        default=[100, 300, 1000])
+    parser.add_argument('--size', default='1600x1200', type=parse_size,
+                        help='size of the images, as ROWSxCOLS')
+    parser.add_argument('--images', type=int, default=5,
+                        help='images per background and skin')
+    parser.add_argument('--min-agreement', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    size = args.size
+    images = [i for _, i in synthetic.images(rng, [size], args.images)]
+
+    print('{:>6} {:<8} {:>10} {:>10} {:>8} {:>8}'.format(
+        'rows', 'type', 'ms/img', 'peak (MB)', 'exact', 'jaccard'))
+    diverged = False
+    for rows in args.rows:
+        reference = None
+        for p in PRECISIONS:
+            tags, elapsed, peak = run(p, rows, images, samples, labels,
+                                      args.seed)
+            if reference is None:
+                reference = tags
+
+            exact, jaccard = agreement(tags, reference)
+            diverged |= exact < args.min_agreement
+            print('{:>6} {:<8} {:>10.1f} {:>10.1f} {:>8.3f} {:>8.3f}'.format(
+                rows, p, elapsed * 1000, peak / 2 ** 20, exact, jaccard))
+
+    if diverged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
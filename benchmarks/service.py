@@ -0,0 +1,243 @@
+"""
+Load test the extraction service started by `color-extractor --serve`.
+
+For each batch size, the service is started on a Unix socket and
+`--clients` threads post `--requests` synthetic JPEG images (see
+`benchmarks.synthetic`) to it as fast as it answers. The throughput, the
+latency percentiles and the mean batch size reported by `/stats` are
+printed. The service is also started in-process on a TCP port to check
+requests by URI and the errors, and on Unix sockets to check what is found
+at their path is only replaced when it is a stale socket. The exit status
+is 1 if any request fails or gets other colors than `ImageToColor` alone.
+
+Usage:
+    python -m benchmarks.service --clients 8 --requests 200
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from skimage.io import imsave
+
+from color_extractor import FromFile, Service
+
+from . import synthetic
+from .common import add_cli_argument, check, cli_command, parse_size
+
+
+class UnixConnection(http.client.HTTPConnection):
+    """HTTP connection over the Unix socket `path`"""
+    def __init__(self, path, timeout=60):
+        super(UnixConnection, self).__init__('localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def request(connection, method, path, body=None, headers=None):
+    """Return the status and the decoded JSON body of a request"""
+    connection.request(method, path, body, headers or {})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read().decode('utf-8'))
+
+
+def wait_healthy(connect, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if request(connect(), 'GET', '/health')[0] == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def load(connect, data, clients, requests):
+    """
+    Post `requests` images of `data` from `clients` threads. Return the
+    colors found for each request, by index of the image, the latencies and
+    the time taken.
+    """
+    results = [None] * requests
+    latencies = [0.] * requests
+    indices = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        connection = connect()
+        while True:
+            with lock:
+                i = next(indices, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            status, body = request(connection, 'POST', '/colors',
+                                   data[i % len(data)],
+                                   {'Content-Type': 'image/jpeg'})
+            latencies[i] = time.perf_counter() - start
+            results[i] = body.get('colors') if status == 200 else None
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, latencies, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--size', default='600x450', type=parse_size,
+                        help='size of the images, as ROWSxCOLS')
+    parser.add_argument('--batch-sizes', nargs='+', type=int,
+                        default=[1, 16])
+    parser.add_argument('--batch-window', type=float, default=5,
+                        help='milliseconds')
+    parser.add_argument('--seed', type=int, default=0)
+    add_cli_argument(parser)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    rows, cols = args.size
+    data = []
+    for _, img in synthetic.images(rng, [(rows, cols)], args.images // 4):
+        f = BytesIO()
+        imsave(f, img, format='jpeg', quality=90)
+        data.append(f.getvalue())
+
+    settings = {'cluster': {'random_state': args.seed}}
+    from_file = FromFile(samples, labels, settings)
+    expected = [sorted(from_file._image_to_color.get(from_file._read('', d)))
+                for d in data]
+    command = cli_command(args)
+    ok = True
+
+    with tempfile.TemporaryDirectory() as d:
+        npz = os.path.join(d, 'names.npz')
+        np.savez(npz, samples=samples, labels=labels)
+        settings_file = os.path.join(d, 'settings.json')
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f)
+        path = os.path.join(d, 'service.sock')
+
+        print('{:>6} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'batch', 'img/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+            'mean batch'))
+        for size in args.batch_sizes:
+            # A relative path, which has no '/'.
+            server = subprocess.Popen(command + [
+                '-s', settings_file, '--serve', os.path.basename(path),
+                '--batch-size', str(size),
+                '--batch-window', str(args.batch_window), npz], cwd=d)
+            try:
+                if not wait_healthy(lambda: UnixConnection(path)):
+                    ok &= check('service started', False)
+                    continue
+
+                results, latencies, elapsed = load(
+                    lambda: UnixConnection(path), data, args.clients,
+                    args.requests)
+                _, stats = request(UnixConnection(path), 'GET', '/stats')
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait()
+
+            same = all(r is not None and sorted(r) == expected[i % len(data)]
+                       for i, r in enumerate(results))
+            ok &= same
+            p = np.percentile(latencies, (50, 95, 99)) * 1000
+            print('{:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.2f}'
+                  '{}'.format(size, args.requests / elapsed, p[0], p[1], p[2],
+                              stats['batch_size'],
+                              '' if same else '  WRONG COLORS'))
+
+        ok &= check('socket removed on exit', not os.path.exists(path))
+
+        image = os.path.join(d, 'image.jpg')
+        with open(image, 'wb') as f:
+            f.write(data[0])
+
+        service = Service(samples, labels, settings)
+        host, port = service.start(('127.0.0.1', 0))
+        try:
+            c = http.client.HTTPConnection(host, port)
+            status, body = request(c, 'POST', '/colors',
+                                   json.dumps({'uri': image}),
+                                   {'Content-Type': 'application/json'})
+            ok &= check('colors by URI', status == 200 and
+                        sorted(body['colors']) == expected[0])
+            status, body = request(c, 'POST', '/colors', b'not an image')
+            ok &= check('unreadable image is a 400 error', status == 400)
+            status, body = request(c, 'GET', '/unknown')
+            ok &= check('unknown path is a 404 error', status == 404)
+            status, body = request(c, 'GET', '/stats')
+            ok &= check('stats', status == 200 and body['requests'] == 2 and
+                        body['errors'] == 1 and body['images'] == 1)
+
+            # A blank image fails clustering, alone.
+            imgs = [from_file._read('', b) for b in data[:3]]
+            imgs.insert(1, np.full_like(imgs[0], 255))
+            futures = [service.submit(i) for i in imgs]
+            results = []
+            for f in futures:
+                try:
+                    results.append(sorted(f.result()))
+                except Exception as e:
+                    results.append(e)
+            ok &= check('failing image fails alone',
+                        isinstance(results.pop(1), Exception) and
+                        results == expected[:3])
+        finally:
+            service.close()
+
+        # A file that isn't a socket is left alone.
+        service = Service(samples, labels, settings)
+        try:
+            service.start(image)
+            ok &= check('file not replaced by a socket', False)
+        except ValueError:
+            ok &= check('file not replaced by a socket',
+                        os.path.isfile(image))
+        finally:
+            service.close()
+
+        # Neither is a live socket, and a socket already removed is fine.
+        service = Service(samples, labels, settings)
+        service.start(path)
+        try:
+            Service(samples, labels, settings).start(path)
+            ok &= check('live socket not replaced', False)
+        except OSError:
+            status, _ = request(UnixConnection(path), 'GET', '/health')
+            ok &= check('live socket not replaced', status == 200)
+        os.unlink(path)
+        try:
+            service.close()
+            ok &= check('socket removed before closing', True)
+        except OSError:
+            ok &= check('socket removed before closing', False)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
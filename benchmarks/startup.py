@@ -0,0 +1,153 @@
+"""
+Measure the cold start of the package and check it against time budgets.
+
+Each measure runs in a fresh interpreter, `--repeat` times, and its median
+is compared to its budget:
+    - `import`: the time to import `color_extractor`, which must not load
+      any of the heavy dependencies listed in `HEAVY`.
+    - `first_result`: the time from the import to the colors of a first
+      image, building `ImageToColor` from an npz archive on the way.
+    - `cli`: the wall time of the command line tool on a single image,
+      interpreter startup included.
+The exit status is 1 if a budget is exceeded or a heavy dependency is loaded
+by the import.
+
+Usage:
+    python -m benchmarks.startup --repeat 5
+"""
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from skimage.io import imsave
+
+from . import synthetic
+from .common import add_cli_argument, cli_command
+
+# Modules importing `color_extractor` alone must not load.
+HEAVY = ('sklearn', 'skimage', 'scipy', 'ijson', 'PIL')
+
+_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import color_extractor
+elapsed = time.perf_counter() - start
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{'elapsed': elapsed, 'heavy': heavy}}))
+"""
+
+_FIRST_RESULT = """
+import json, time
+import numpy as np
+img = np.load({image!r})
+with open({settings!r}) as f:
+    settings = json.load(f)
+start = time.perf_counter()
+import color_extractor
+npz = np.load({npz!r})
+i = color_extractor.ImageToColor(npz['samples'], npz['labels'], settings)
+colors = i.get(img)
+print(json.dumps({{'elapsed': time.perf_counter() - start}}))
+"""
+
+
+def run(command, code):
+    """Run `code` in a fresh interpreter and return what it printed"""
+    output = subprocess.run(command + ['-c', code], stdout=subprocess.PIPE,
+                            check=True).stdout
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def run_cli(command, npz, settings, image):
+    start = time.perf_counter()
+    subprocess.run(command + ['-s', settings, npz, image],
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=0.05,
+                        help='seconds (default: 0.05)')
+    parser.add_argument('--first-result-budget', type=float, default=2.,
+                        help='seconds (default: 2)')
+    parser.add_argument('--cli-budget', type=float, default=3.,
+                        help='seconds (default: 3)')
+    parser.add_argument('--settings', default=None,
+                        help='JSON file of settings for the pipeline')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--python', default=None,
+                        help='command running the interpreter (default: '
+                        'this interpreter)')
+    add_cli_argument(parser)
+    args = parser.parse_args()
+
+    settings = {}
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
+    settings.setdefault('cluster', {}).setdefault('random_state', args.seed)
+
+    python = [sys.executable]
+    if args.python:
+        python = shlex.split(args.python)
+    cli = cli_command(args, python)
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    img = synthetic.image(rng, 600, 450)
+
+    with tempfile.TemporaryDirectory() as d:
+        npz = os.path.join(d, 'names.npz')
+        np.savez(npz, samples=samples, labels=labels)
+        image = os.path.join(d, 'image.npy')
+        np.save(image, img)
+        jpeg = os.path.join(d, 'image.jpg')
+        imsave(jpeg, img, quality=90)
+        settings_file = os.path.join(d, 'settings.json')
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f)
+
+        imports = [run(python, _IMPORT.format(heavy=HEAVY))
+                   for _ in range(args.repeat)]
+        code = _FIRST_RESULT.format(image=image, npz=npz,
+                                    settings=settings_file)
+        first = [run(python, code)['elapsed'] for _ in range(args.repeat)]
+        cli_runs = [run_cli(cli, npz, settings_file, jpeg)
+                    for _ in range(args.repeat)]
+
+    measures = (
+        ('import', [i['elapsed'] for i in imports], args.import_budget),
+        ('first_result', first, args.first_result_budget),
+        ('cli', cli_runs, args.cli_budget),
+    )
+
+    failed = False
+    print('{:<14} {:>10} {:>10} {:>10}'.format('', 'p50 (s)', 'max (s)',
+                                               'budget (s)'))
+    for name, times, budget in measures:
+        median = statistics.median(times)
+        over = median > budget
+        failed |= over
+        print('{:<14} {:>10.3f} {:>10.3f} {:>10.3f}{}'.format(
+            name, median, max(times), budget, '  OVER BUDGET' if over else ''))
+
+    heavy = sorted({m for i in imports for m in i['heavy']})
+    if heavy:
+        failed = True
+        print('Importing color_extractor loaded: {}'.format(', '.join(heavy)))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
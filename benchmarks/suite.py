@@ -0,0 +1,285 @@
+"""
+Time each step of the pipeline, the complete pipeline and the CLI on
+synthetic images, and flag regressions against a saved baseline.
+
+Images are generated from a seed (see `benchmarks.synthetic`) so two runs
+with the same arguments process the same pixels. Each step is timed on the
+output of the previous ones, computed beforehand: `resize` on the generated
+images, `back` and `skin` on the resized images, `cluster` on the pixels
+left after masking, `selector` on the clusters found and `name` on the
+selected centers. `image_to_color` runs the complete pipeline on the
+generated images and `cli` the command line tool on the same images saved as
+JPEG files, in a separate process.
+
+For each benchmark the report holds the number of items processed per
+second, the 50th, 95th and 99th percentiles of the latency of an item in
+seconds, and the peak memory allocated while processing an item in bytes
+(the peak resident size of the process for `cli`). When a baseline report
+is given, benchmarks whose median latency, throughput or peak memory got
+worse by more than the tolerance are listed and the exit status is 1.
+
+Usage:
+    python -m benchmarks.suite --output report.json
+    python -m benchmarks.suite --baseline report.json --output new.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+import sklearn
+import skimage
+from skimage.io import imsave
+
+from color_extractor import (Back, Cluster, ImageToColor, Name, Resize,
+                             Selector, Skin)
+
+from . import synthetic
+from .common import add_cli_argument, cli_command, parse_size
+
+BENCHMARKS = ('resize', 'back', 'skin', 'cluster', 'selector', 'name',
+              'image_to_color', 'cli')
+
+# Measures compared against the baseline, and whether lower is better.
+MEASURES = (('latency.p50', True), ('throughput', False),
+            ('peak_memory', True))
+
+
+def measure(calls, repeat):
+    """
+    Time each of `calls` `repeat` times, after a first untimed run of all of
+    them. The peak memory is measured in a separate run as tracing
+    allocations slows them down.
+    """
+    for c in calls:
+        c()
+
+    latencies = []
+    for _ in range(repeat):
+        for c in calls:
+            start = time.perf_counter()
+            c()
+            latencies.append(time.perf_counter() - start)
+
+    peak = 0
+    for c in calls:
+        tracemalloc.start()
+        c()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return summarize(latencies, peak)
+
+
+def summarize(latencies, peak, items=1):
+    """Return the measures of a benchmark whose runs processed `items`"""
+    latencies = np.array(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'runs': len(latencies),
+        'throughput': items * len(latencies) / latencies.sum(),
+        'latency': {'p50': p50, 'p95': p95, 'p99': p99},
+        'peak_memory': int(peak),
+    }
+
+
+def pipeline_calls(images, samples, labels, settings):
+    """
+    Return the calls to time for each step of the pipeline and for the
+    complete pipeline, the input of each step being computed beforehand.
+    """
+    resize = Resize(settings.get('resize'))
+    back = Back(settings.get('back'))
+    skin = Skin(settings.get('skin'))
+    cluster = Cluster(settings.get('cluster'))
+    selector = Selector(settings.get('selector'))
+    name = Name(samples, labels, settings.get('name'))
+    image_to_color = ImageToColor(samples, labels, settings)
+
+    resized = [resize.get(i) for i in images]
+    pixels = [r[~(back.get(r) | skin.get(r))] for r in resized]
+    clusters = [cluster.get(p) for p in pixels]
+    centers = [c for k, l, cs in clusters for c in selector.get(k, l, cs)]
+
+    return {
+        'resize': [partial(resize.get, i) for i in images],
+        'back': [partial(back.get, r) for r in resized],
+        'skin': [partial(skin.get, r) for r in resized],
+        'cluster': [partial(cluster.get, p) for p in pixels],
+        'selector': [partial(selector.get, *c) for c in clusters],
+        'name': [partial(name.get, c) for c in centers],
+        'image_to_color': [partial(image_to_color.get, i) for i in images],
+    }
+
+
+def run_cli(command, images, npz, settings, repeat):
+    """
+    Time the CLI on `images` saved as JPEG files, `repeat` times. The
+    latency of a run is the time to process all images.
+    """
+    with tempfile.TemporaryDirectory() as d:
+        files = []
+        for i, img in enumerate(images):
+            files.append(os.path.join(d, '{}.jpg'.format(i)))
+            imsave(files[-1], img, quality=90)
+
+        settings_file = os.path.join(d, 'settings.json')
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f)
+
+        args = command + ['--settings', settings_file, npz] + files
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+            latencies.append(time.perf_counter() - start)
+
+    # Kilobytes on Linux, the largest of all child processes so far.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return summarize(latencies, peak, len(images))
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return the `(benchmark, measure, baseline, value, change)` of the
+    measures which got worse by more than `tolerance` compared to
+    `baseline`, along with all compared measures.
+    """
+    compared, regressions = [], []
+    for b, measures in sorted(report['benchmarks'].items()):
+        if b not in baseline['benchmarks']:
+            continue
+
+        for key, lower_is_better in MEASURES:
+            new = _get(measures, key)
+            old = _get(baseline['benchmarks'][b], key)
+            change = (new - old) / old if old else 0.
+            row = b, key, old, new, change
+            compared.append(row)
+            worse = change if lower_is_better else -change
+            if worse > tolerance:
+                regressions.append(row)
+
+    return compared, regressions
+
+
+def _get(measures, key):
+    for k in key.split('.'):
+        measures = measures[k]
+    return measures
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'scikit-learn': sklearn.__version__,
+        'scikit-image': skimage.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', default='benchmark.json',
+                        help='path of the JSON report')
+    parser.add_argument('--baseline', help='JSON report to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change flagged as a regression')
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=[(300, 240), (800, 600), (1600, 1200)],
+                        help='sizes of the images, as ROWSxCOLS')
+    parser.add_argument('--images', type=int, default=3,
+                        help='images per size, background and skin')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--settings', help='JSON settings of the pipeline')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS)
+    add_cli_argument(parser)
+    args = parser.parse_args()
+
+    settings = {}
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
+    # Make K-Means deterministic so that runs cluster the same way.
+    cluster = settings.setdefault('cluster', {})
+    cluster.setdefault('random_state', args.seed)
+
+    rng = np.random.RandomState(args.seed)
+    samples, labels = synthetic.samples(rng)
+    images = [i for _, i in synthetic.images(rng, args.sizes, args.images)]
+
+    report = {
+        'environment': _environment(),
+        'arguments': {
+            'sizes': args.sizes,
+            'images': len(images),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'settings': settings,
+        },
+        'benchmarks': {},
+    }
+
+    calls = pipeline_calls(images, samples, labels, settings)
+    for b in args.only:
+        if b == 'cli':
+            continue
+        report['benchmarks'][b] = measure(calls[b], args.repeat)
+        _print_measures(b, report['benchmarks'][b])
+
+    if 'cli' in args.only:
+        command = cli_command(args)
+
+        with tempfile.NamedTemporaryFile(suffix='.npz') as npz:
+            np.savez(npz, samples=samples, labels=labels)
+            npz.flush()
+            m = run_cli(command, images, npz.name, settings, args.repeat)
+        report['benchmarks']['cli'] = m
+        _print_measures('cli', m)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    compared, regressions = compare(report, baseline, args.tolerance)
+    print()
+    print('{:<16} {:<12} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'measure', 'baseline', 'current', 'change'))
+    for b, key, old, new, change in compared:
+        flag = ' !' if (b, key, old, new, change) in regressions else ''
+        print('{:<16} {:<12} {:>12.4g} {:>12.4g} {:>+7.1%}{}'.format(
+            b, key, old, new, change, flag))
+
+    if regressions:
+        print('\n{} regression(s) above {:.0%}'.format(len(regressions),
+                                                       args.tolerance))
+        sys.exit(1)
+
+
+def _print_measures(benchmark, m):
+    l = m['latency']
+    print('{:<16} {:>10.1f}/s  p50 {:>8.2f} ms  p95 {:>8.2f} ms  '
+          'p99 {:>8.2f} ms  peak {:>8.1f} MB'.format(
+              benchmark, m['throughput'], l['p50'] * 1000, l['p95'] * 1000,
+              l['p99'] * 1000, m['peak_memory'] / 2 ** 20))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
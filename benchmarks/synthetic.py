@@ -0,0 +1,101 @@
+"""
+Synthetic inputs for the benchmarks, generated offline and reproducible from
+a seed: e-commerce style pictures of a centered object on a flat or gradient
+background, optionally with skin showing, and samples to learn color names
+from.
+"""
+import numpy as np
+
+# Named colors the synthetic samples are labeled with, in RGB.
+PALETTE = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'gray': (128, 128, 128),
+    'red': (220, 20, 30),
+    'green': (30, 150, 40),
+    'blue': (30, 60, 210),
+    'yellow': (250, 220, 20),
+    'orange': (250, 140, 0),
+    'purple': (120, 30, 140),
+    'pink': (250, 170, 200),
+    'brown': (130, 70, 20),
+    'beige': (225, 205, 165),
+    'navy': (10, 20, 90),
+    'teal': (0, 128, 128),
+}
+
+# Main colors of the objects. White would be taken for the background, and
+# orange and brown for skin, leaving no pixel to cluster.
+OBJECT_COLORS = ('black', 'gray', 'red', 'green', 'blue', 'yellow', 'purple',
+                 'pink', 'beige', 'navy', 'teal')
+
+# Skin tones, from light to dark, in RGB.
+SKIN_TONES = ((241, 194, 167), (224, 172, 135), (198, 134, 96),
+              (141, 85, 56))
+
+BACKGROUNDS = ('flat', 'gradient')
+
+
+def samples(rng, n=10000):
+    """
+    Return `n` random colors in the `[0, 255]` range and the name of the
+    color of `PALETTE` each of them is the closest to.
+    """
+    s = rng.randint(0, 256, (n, 3)).astype(np.float64)
+    names = np.array(list(PALETTE))
+    colors = np.array(list(PALETTE.values()), np.float64)
+    d = np.sum(np.square(s[:, np.newaxis] - colors[np.newaxis]), axis=2)
+    return s, names[np.argmin(d, axis=1)]
+
+
+def image(rng, rows, cols, background='flat', skin=False, noise=2.):
+    """
+    Return a `rows` by `cols` RGB `uint8` picture of a centered object made
+    of a main color and a detail color. The background is either a flat
+    light color or a vertical gradient between two light colors. If `skin`
+    is set an arm crosses the object.
+    """
+    yy, xx = np.mgrid[:rows, :cols]
+    yy = yy / rows - 0.5
+    xx = xx / cols - 0.5
+
+    if background == 'flat':
+        img = np.empty((rows, cols, 3)) + rng.uniform(220, 255, 3)
+    elif background == 'gradient':
+        top, bottom = rng.uniform(200, 255, (2, 3))
+        t = (yy + 0.5)[:, :, np.newaxis]
+        img = top * (1 - t) + bottom * t
+    else:
+        raise ValueError('Unknown background {}'.format(background))
+
+    main = PALETTE[OBJECT_COLORS[rng.randint(len(OBJECT_COLORS))]]
+    detail = list(PALETTE.values())[rng.randint(len(PALETTE))]
+    img[(yy / 0.35) ** 2 + (xx / 0.3) ** 2 < 1] = main
+    img[(yy / 0.1) ** 2 + (xx / 0.08) ** 2 < 1] = detail
+
+    if skin:
+        tone = SKIN_TONES[rng.randint(len(SKIN_TONES))]
+        arm = (np.abs(yy + 0.5 * xx) < 0.06) & (xx > -0.1)
+        img[arm] = tone
+
+    img += rng.normal(0, noise, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def images(rng, sizes, count):
+    """
+    Return `count` images of each combination of the `(rows, cols)` sizes
+    of `sizes`, of background and of skin, along with the name of their
+    combination.
+    """
+    result = []
+    for rows, cols in sizes:
+        for background in BACKGROUNDS:
+            for skin in (False, True):
+                variant = '{}x{}-{}{}'.format(rows, cols, background,
+                                              '-skin' if skin else '')
+                for _ in range(count):
+                    img = image(rng, rows, cols, background, skin)
+                    result.append((variant, img))
+
+    return result
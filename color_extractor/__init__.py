@@ -1,13 +1,37 @@
-from .resize import Resize
-from .back import Back
-from .skin import Skin
-from .cluster import Cluster
-from .selector import Selector
-from .name import Name
-from .image_to_color import ImageToColor
-from .from_file import FromFile
-from .from_json import FromJson
-from .exceptions import KMeansException
+from importlib import import_module
+
+from .exceptions import FetchException, KMeansException
 
 __all__ = ['Resize', 'Back', 'Skin', 'Cluster', 'Selector', 'Name',
-           'ImageToColor', 'FromFile', 'FromJson', 'KMeansException']
+           'ImageToColor', 'FromFile', 'FromJson', 'Service', 'DebugSink',
+           'FetchException', 'KMeansException']
+
+# Modules of the classes, imported on first access only so that importing the
+# package doesn't load scikit-learn and scikit-image.
+_MODULES = {
+    'Resize': 'resize',
+    'Back': 'back',
+    'Skin': 'skin',
+    'Cluster': 'cluster',
+    'Selector': 'selector',
+    'Name': 'name',
+    'ImageToColor': 'image_to_color',
+    'FromFile': 'from_file',
+    'FromJson': 'from_json',
+    'Service': 'service',
+    'DebugSink': 'debug',
+}
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+
+    value = getattr(import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
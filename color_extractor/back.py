@@ -3,7 +3,9 @@ import skimage.filters as skf
 import skimage.color as skc
 import skimage.morphology as skm
 from skimage.measure import label
+from skimage.util import img_as_float, img_as_float32
 
+from .quantize import cell_centers, cell_index
 from .task import Task
 
 
@@ -11,10 +13,13 @@ class Back(Task):
     """
     Two algorithms are used together to separate background and foreground.
     One consider as background all pixel whose color is close to the pixels
-    in the corners. This part is impacted by the `max_distance' and
-    `use_lab' settings.
+    in the corners. This part is impacted by the `max_distance', `use_lab'
+    and `lab_lut' settings.
     The second one computes the edges of the image and uses a flood fill
     starting from all corners.
+    The cheaper first mask is computed first and, with the `lazy' setting,
+    the flood fill is skipped for images whose background is flat: corners of
+    close colors and a border made of pixels close to them.
     """
     def __init__(self, settings=None):
         """
@@ -27,15 +32,99 @@ class Back(Task):
             - use_lab: Whether to use the LAB color space to perform
               background removal. More expensive but closer to eye perception.
               (default: True)
+
+            - lab_lut: Convert colors to LAB with a lookup table of the LAB
+              color of every cell of a quantized RGB cube, built once, instead
+              of computing the conversion for every pixel. Distances are a bit
+              less accurate.
+              (default: False)
+
+            - lab_lut.step: The width of the cells of the lookup table along
+              each channel, in the `[0, 255]` range. The table takes
+              `3 * 4 * (256 / step) ** 3` bytes.
+              (default: 4)
+
+            - floodfill: The engine filling the background from the corners,
+              either 'label' which labels all connected regions of the image
+              or 'flood' which only visits the regions of the corners. Both
+              give the same mask, 'flood' is faster on images of a few hundred
+              rows or more.
+              (default: 'label')
+
+            - lazy: Skip the flood fill when the background is flat: the
+              colors of the corners are within 'max_distance' of each other,
+              at least 95% of the pixels of the border of the image are close
+              to them, and the pixels close to the corners cover at least
+              'lazy.threshold' of the image (and less than 90% of it, above
+              which the flood fill decides). The mask of the first algorithm
+              is then returned alone. Gradients and other backgrounds varying
+              along the border still go through the flood fill.
+              (default: False)
+
+            - lazy.threshold: The part of the image the pixels close to the
+              corners must cover for the flood fill to be skipped.
+              (default: 0.3)
         """
         if settings is None:
             settings = {}
 
         super(Back, self).__init__(settings)
+        self._lab_table = None
+        if self._settings['use_lab'] and self._settings['lab_lut']:
+            self._lab_table = Back._lab_lut(self._settings['lab_lut.step'])
+
+    def get(self, img, record=None):
+        """
+        Return the background mask of `img`. Whether the flood fill was
+        skipped is stored in `record` under 'floodfill_skipped' if given.
+        """
+        g, flat = self._global(img)
+        skip = self._skip_floodfill(g, flat)
+        if record is not None:
+            record['floodfill_skipped'] = int(skip)
+
+        if skip:
+            return g
+        return Back._combine(self._floodfill(img), g)
+
+    def get_batch(self, imgs, record=None):
+        """
+        Compute the background masks of a stack of images of shape
+        `(n, h, w, 3)`. The distances to the corners are computed for all
+        images at once. The number of images whose flood fill was skipped is
+        added to `record` under 'floodfill_skipped' if given.
+        """
+        g, flat = self._global(imgs)
+        masks = []
+        skipped = 0
+        for i, gi, fi in zip(imgs, g, flat):
+            if self._skip_floodfill(gi, fi):
+                masks.append(gi)
+                skipped += 1
+            else:
+                masks.append(Back._combine(self._floodfill(i), gi))
 
-    def get(self, img):
-        f = self._floodfill(img)
-        g = self._global(img)
+        if record is not None:
+            record.add('floodfill_skipped', skipped)
+        return np.stack(masks)
+
+    def _skip_floodfill(self, g, flat):
+        """
+        Whether the global mask `g` can be used without flood fill, given
+        whether the colors of the corners are close to each other.
+        """
+        if not self._settings['lazy'] or not flat:
+            return False
+
+        border = np.concatenate((g[0], g[-1], g[1:-1, 0], g[1:-1, -1]))
+        if np.count_nonzero(border) < Back._FLAT_BORDER * border.size:
+            return False
+
+        n = np.count_nonzero(g)
+        return self._settings['lazy.threshold'] * g.size <= n < 0.90 * g.size
+
+    @staticmethod
+    def _combine(f, g):
         m = f | g
 
         if np.count_nonzero(m) < 0.90 * m.size:
@@ -56,21 +145,88 @@ class Back(Task):
         return np.zeros_like(m)
 
     def _global(self, img):
-        h, w = img.shape[:2]
-        mask = np.zeros((h, w), dtype=np.bool)
-        max_distance = self._settings['max_distance']
+        """
+        Return the mask of pixels close to one of the corners, and whether
+        the colors of the corners are all close to each other. `img` can be a
+        single image or a stack of images.
+        """
+        planes = self._planes(img)
+        rows, cols = img.shape[-3:-1]
+        planes = planes.reshape(3, -1, rows * cols)
+        mask = np.empty(planes.shape[1:], dtype=np.bool_)
+        flat = np.empty(planes.shape[1], dtype=np.bool_)
+        max_square = self._settings['max_distance'] ** 2
+
+        # Same corners as (0, 0), (-1, 0), (0, -1), (-1, -1) once flattened.
+        corners = [0, (rows - 1) * cols, cols - 1, rows * cols - 1]
+        for n in range(planes.shape[1]):
+            colors = planes[:, n, corners]
+            d = colors[:, :, np.newaxis] - colors[:, np.newaxis, :]
+            flat[n] = np.all(np.sum(d ** 2, axis=0) < max_square)
+            # Chunks of pixels keep the temporary arrays in the CPU caches.
+            for start in range(0, rows * cols, Back._CHUNK):
+                p = planes[:, n, start:start + Back._CHUNK]
+                d = Back._min_square_distance(p, colors)
+                np.less(d, max_square, out=mask[n, start:start + len(d)])
+
+        return mask.reshape(img.shape[:-1]), flat.reshape(img.shape[:-3])
+
+    # Number of pixels whose distances are computed at once.
+    _CHUNK = 16384
 
-        if self._settings['use_lab']:
-            img = skc.rgb2lab(img)
+    # The part of the border of the image close to the corners for the
+    # background to be considered flat.
+    _FLAT_BORDER = 0.95
 
-        # Compute euclidean distance of each corner against all other pixels.
-        corners = [(0, 0), (-1, 0), (0, -1), (-1, -1)]
-        for color in (img[i, j] for i, j in corners):
-            norm = np.sqrt(np.sum(np.square(img - color), 2))
-            # Add to the mask pixels close to one of the corners.
-            mask |= norm < max_distance
+    def _planes(self, img):
+        """
+        Return the channels of `img` as contiguous `float32` planes, in the
+        LAB color space if 'use_lab' is set.
+        """
+        if not self._settings['use_lab']:
+            img = np.moveaxis(img_as_float32(img), -1, 0)
+            return np.ascontiguousarray(img, np.float32)
+
+        if self._lab_table is not None:
+            i = cell_index(img, self._settings['lab_lut.step'])
+            return self._lab_table[:, i]
+
+        lab = Back._per_pixel(skc.rgb2lab, img)
+        return np.ascontiguousarray(np.moveaxis(lab, -1, 0), np.float32)
 
-        return mask
+    @staticmethod
+    def _min_square_distance(planes, colors):
+        """
+        Return the square of the euclidean distance of each pixel of `planes`
+        to the closest of `colors`, given as planes as well.
+        """
+        best = None
+        d = np.empty(planes.shape[1:], np.float32)
+        t = np.empty_like(d)
+        for c in colors.T:
+            np.subtract(planes[0], c[0], out=d)
+            np.square(d, out=d)
+            for k in (1, 2):
+                np.subtract(planes[k], c[k], out=t)
+                np.square(t, out=t)
+                d += t
+
+            if best is None:
+                best = d.copy()
+            else:
+                np.minimum(best, d, out=best)
+
+        return best
+
+    @staticmethod
+    def _lab_lut(step):
+        """
+        Return the LAB color of the center of every cell of the RGB cube
+        quantized with `step`, as `float32` planes.
+        """
+        rgb = cell_centers(step)[np.newaxis] / 255.
+        lab = skc.rgb2lab(rgb)[0]
+        return np.ascontiguousarray(lab.T, np.float32)
 
     def _floodfill(self, img):
         back = Back._scharr(img)
@@ -84,27 +240,63 @@ class Back(Task):
         back[0, :] = back[-1, :] = True
         back[:, 0] = back[:, -1] = True
 
-        # Label adjacent pixels of the same color.
-        labels = label(back, background=-1, connectivity=1)
+        e = self._settings['floodfill']
+        if e == 'label':
+            back = Back._fill_label(back)
+        elif e == 'flood':
+            back = Back._fill_flood(back)
+        else:
+            raise ValueError('Unknown floodfill engine {}'.format(e))
+
+        # Remove remaining inner edges.
+        return skm.opening(back)
+
+    # Pixels the flood fill starts from, inside the artificial border edges.
+    _CORNERS = [(1, 1), (-2, 1), (1, -2), (-2, -2)]
+
+    @staticmethod
+    def _fill_label(back):
+        # Label adjacent pixels of the same color. Recent versions of
+        # scikit-image ignore `background` for boolean images and give all
+        # `False` pixels the same label, hence the conversion.
+        labels = label(back.view(np.uint8), background=-1, connectivity=1)
 
         # Count as background all pixels labeled like one of the corners.
-        corners = [(1, 1), (-2, 1), (1, -2), (-2, -2)]
-        for l in (labels[i, j] for i, j in corners):
+        for l in (labels[i, j] for i, j in Back._CORNERS):
             back[labels == l] = True
 
-        # Remove remaining inner edges.
-        return skm.opening(back)
+        return back
+
+    @staticmethod
+    def _fill_flood(back):
+        # Only used by this engine, imported on first use.
+        from skimage.segmentation import flood
+
+        # Regions of edges are already background, only fill the others.
+        # Corners sharing a region are filled once.
+        filled = back.copy()
+        for i, j in Back._CORNERS:
+            if not filled[i, j]:
+                seed = i % back.shape[0], j % back.shape[1]
+                filled |= flood(back, seed, connectivity=1)
+
+        return filled
 
     @staticmethod
     def _default_settings():
         return {
             'max_distance': 5,
             'use_lab': True,
+            'lab_lut': False,
+            'lab_lut.step': 4,
+            'floodfill': 'label',
+            'lazy': False,
+            'lazy.threshold': 0.3,
         }
 
     @staticmethod
     def _scharr(img):
         # Invert the image to ease edge detection.
-        img = 1. - img
-        grey = skc.rgb2grey(img)
+        img = 1. - img_as_float(img)
+        grey = skc.rgb2gray(img)
         return skf.scharr(grey)
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class Cache(object):
+    """
+    Persistent cache of the centers found in images, stored in a SQLite file.
+    Entries are keyed by a hash of the bytes of the image and of
+    `fingerprint`, which must identify everything else the centers depend on
+    (settings, samples and labels). Once the cache holds more than
+    `max_entries` entries the least recently used ones are evicted. The size
+    is checked every `_CHECK_EVERY` insertions.
+    The cache can be shared by several threads and several processes.
+    """
+    def __init__(self, path, fingerprint='', max_entries=1000000):
+        self._fingerprint = fingerprint.encode('utf-8')
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(path, timeout=30,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS centers '
+                             '(key TEXT PRIMARY KEY, centers TEXT, '
+                             'used INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS centers_used '
+                             'ON centers (used)')
+
+    def key(self, data):
+        """Return the key of the image whose bytes are `data`"""
+        h = hashlib.sha256(self._fingerprint)
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the centers stored under `key`, or `None`"""
+        with self._lock, self._db:
+            row = self._db.execute('SELECT centers FROM centers '
+                                   'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute('UPDATE centers SET used = ? WHERE key = ?',
+                             (self._clock(), key))
+
+        return np.array(json.loads(row[0]), np.float64)
+
+    def put(self, key, centers):
+        """Store `centers` under `key`, evicting old entries if needed"""
+        centers = json.dumps(np.asarray(centers).tolist())
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO centers VALUES (?, ?, ?)',
+                             (key, centers, self._clock()))
+            self._puts += 1
+            if self._puts % Cache._CHECK_EVERY:
+                return
+
+            n, = self._db.execute('SELECT COUNT(*) FROM centers').fetchone()
+            if n > self._max_entries:
+                self._db.execute('DELETE FROM centers WHERE key IN '
+                                 '(SELECT key FROM centers '
+                                 'ORDER BY used LIMIT ?)',
+                                 (n - self._max_entries,))
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM centers')
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    # Counting entries isn't free, eviction is only done from time to time.
+    _CHECK_EVERY = 100
+
+    def _clock(self):
+        # Shared by all processes using the file, unlike a local counter.
+        n, = self._db.execute('SELECT COALESCE(MAX(used), 0) + 1 '
+                              'FROM centers').fetchone()
+        return n
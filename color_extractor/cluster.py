@@ -1,6 +1,11 @@
-from sklearn.cluster import KMeans
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+
+import numpy as np
+from threadpoolctl import ThreadpoolController
 
 from .exceptions import KMeansException
+from .quantize import cell_index
 from .task import Task
 
 
@@ -8,8 +13,54 @@ class Cluster(Task):
     """
     Use the K-Means algorithm to group pixels by clusters. The algorithm tries
     to determine the optimal number of clusters for the given pixels.
+    The median cut algorithm can be used instead of K-Means. It's not
+    iterative and clusters pixels in a single pass for all numbers of
+    clusters.
     """
     def __init__(self, settings=None):
+        """
+        The possible settings are:
+            - min_k: The minimum number of clusters to consider.
+              (default: 2)
+
+            - max_k: The maximum number of clusters to consider (excluded).
+              (default: 7)
+
+            - algorithm: The clustering algorithm to use, either 'kmeans' or
+              'median_cut'. 'median_cut' is deterministic and its running time
+              only depends on the number of pixels, the settings specific to
+              K-Means are ignored.
+              (default: 'kmeans')
+
+            - histogram: Group pixels of close colors in the cells of a color
+              histogram and cluster the cells, weighted by their number of
+              pixels, instead of every pixel.
+              (default: False)
+
+            - histogram.step: The width of a cell of the histogram along each
+              channel, in the `[0, 255]` range.
+              (default: 8)
+
+            - warm_start: Initialize the clustering with `k` clusters from the
+              solution found with `k - 1` clusters, splitting the cluster of
+              highest inertia in two, instead of starting from scratch.
+              (default: False)
+
+            - early_stop: Stop trying larger numbers of clusters once the jump
+              statistic didn't improve for this many consecutive values of
+              `k`. `0` always tries all values.
+              (default: 0)
+
+            - n_jobs: The number of values of `k` to try concurrently. The
+              threads used by each K-Means are limited so that all of them
+              share the available cores. Ignored with 'warm_start' as each
+              value of `k` then depends on the previous one.
+              (default: 1)
+
+            - random_state: The seed given to K-Means. Set it to get the same
+              clusters every time.
+              (default: None)
+        """
         if settings is None:
             settings = {}
 
@@ -17,33 +68,45 @@ class Cluster(Task):
         self._kmeans_args = {
             'max_iter': 50,
             'tol': 1.0,
+            'random_state': self._settings['random_state'],
         }
+        self._threadpools = None
 
     def get(self, img):
         a = self._settings['algorithm']
         if a == 'kmeans':
-            return self._jump(img)
+            return self._jump(img, self._sweep)
+        elif a == 'median_cut':
+            return self._jump(img, self._median_cut)
         else:
             raise ValueError('Unknown algorithm {}'.format(a))
 
-    def _kmeans(self, img, k):
-        kmeans = KMeans(n_clusters=k, **self._kmeans_args)
+    def _kmeans(self, img, k, weights=None, init=None):
+        # Not needed by 'median_cut', imported on first use.
+        from sklearn.cluster import KMeans
+
+        args = dict(self._kmeans_args)
+        if init is not None:
+            args.update(init=init, n_init=1)
+
+        kmeans = KMeans(n_clusters=k, **args)
         try:
-            kmeans.fit(img)
+            kmeans.fit(img, sample_weight=weights)
         except:
             raise KMeansException()
 
         return kmeans.inertia_, kmeans.labels_, kmeans.cluster_centers_
 
-    def _jump(self, img):
+    def _jump(self, img, sweep):
         npixels = img.size
+        points, weights, inverse = self._points(img)
 
         best = None
         prev_distorsion = 0
         largest_diff = float('-inf')
+        no_improvement = 0
 
-        for k in range(self._settings['min_k'], self._settings['max_k']):
-            compact, labels, centers = self._kmeans(img, k)
+        for k, compact, labels, centers in sweep(points, weights):
             distorsion = Cluster._square_distorsion(npixels, compact, 1.5)
             diff = prev_distorsion - distorsion
             prev_distorsion = distorsion
@@ -51,8 +114,173 @@ class Cluster(Task):
             if diff > largest_diff:
                 largest_diff = diff
                 best = k, labels, centers
+                no_improvement = 0
+            else:
+                no_improvement += 1
+                if no_improvement == self._settings['early_stop']:
+                    break
+
+        if best is None:
+            raise KMeansException()
+
+        k, labels, centers = best
+        if inverse is not None:
+            labels = labels[inverse]
+
+        return k, labels, centers
+
+    def _sweep(self, points, weights):
+        """Yield the clustering of `points` for each value of `k` to try."""
+        ks = range(self._settings['min_k'], self._settings['max_k'])
+        if self._settings['n_jobs'] > 1 and not self._settings['warm_start']:
+            yield from self._parallel_sweep(points, weights, ks)
+            return
+
+        centers = None
+        for k in ks:
+            init = None
+            if self._settings['warm_start'] and centers is not None:
+                init = Cluster._split(points, weights, labels, centers)
+
+            compact, labels, centers = self._kmeans(points, k, weights, init)
+            yield k, compact, labels, centers
+
+    def _parallel_sweep(self, points, weights, ks):
+        """
+        Cluster `points` for all values of `ks` on a pool of threads. Results
+        are yielded in the order of `ks`, whatever the order they complete.
+        """
+        n_jobs = self._settings['n_jobs']
+        threads = max(1, (cpu_count() or 1) // n_jobs)
+        if self._threadpools is None:
+            # Finding the thread pools scans the loaded libraries, which is
+            # slow, so it is done once, after scikit-learn has loaded its
+            # OpenMP runtime.
+            import sklearn.cluster  # noqa: F401
+            self._threadpools = ThreadpoolController()
+
+        def kmeans(k):
+            # OpenMP limits are per thread, they must be set in the worker.
+            with self._threadpools.limit(limits=threads, user_api='openmp'):
+                return self._kmeans(points, k, weights)
+
+        with ThreadPoolExecutor(n_jobs) as pool:
+            futures = [pool.submit(kmeans, k) for k in ks]
+            try:
+                for k, f in zip(ks, futures):
+                    compact, labels, centers = f.result()
+                    yield k, compact, labels, centers
+            finally:
+                # Don't start fits made useless by an early stop.
+                for f in futures:
+                    f.cancel()
+
+    def _median_cut(self, points, weights):
+        """
+        Yield the clustering of `points` for each value of `k` to try using
+        the median cut algorithm. The clusters with `k + 1` boxes are made by
+        cutting the box of highest inertia of the `k` boxes solution in two
+        halves of equal weight, along its channel of largest range.
+        """
+        if len(points) == 0:
+            raise KMeansException()
+
+        if weights is None:
+            weights = np.ones(len(points))
+
+        boxes = [np.arange(len(points))]
+        stats = [Cluster._box_stats(points, weights, boxes[0])]
+        while True:
+            k = len(boxes)
+            if k >= self._settings['min_k']:
+                labels = np.empty(len(points), np.intp)
+                for i, b in enumerate(boxes):
+                    labels[b] = i
+                centers = np.array([m for m, _ in stats])
+                yield k, sum(i for _, i in stats), labels, centers
+
+            if k + 1 >= self._settings['max_k']:
+                return
+
+            worst = int(np.argmax([i for _, i in stats]))
+            if stats[worst][1] == 0:
+                # All boxes have a single color, they can't be cut anymore.
+                return
+
+            left, right = Cluster._cut(points, weights, boxes[worst])
+            boxes[worst] = left
+            stats[worst] = Cluster._box_stats(points, weights, left)
+            boxes.append(right)
+            stats.append(Cluster._box_stats(points, weights, right))
+
+    def _points(self, img):
+        """
+        Return the points to cluster, their weights and the index of the
+        point of each pixel of `img`. Unless 'histogram' is set, the points
+        are the pixels themselves.
+        """
+        if self._settings['histogram']:
+            points, weights, inverse = Cluster._histogram(
+                img, self._settings['histogram.step'])
+            # Not enough distinct colors to try all values of k.
+            if len(points) >= self._settings['max_k'] - 1:
+                return points, weights, inverse
+
+        return img, None, None
+
+    @staticmethod
+    def _histogram(img, step):
+        """
+        Group the pixels of `img` by cells of a color histogram. Return the
+        mean color of the pixels of each non-empty cell, their number and the
+        index of the cell of each pixel.
+        """
+        cells = cell_index(img, step)
+        _, inverse, counts = np.unique(cells, return_inverse=True,
+                                       return_counts=True)
+
+        means = np.empty((len(counts), img.shape[1]), np.float64)
+        for c in range(img.shape[1]):
+            means[:, c] = np.bincount(inverse, img[:, c]) / counts
+
+        return means, counts, inverse
+
+    @staticmethod
+    def _box_stats(points, weights, box):
+        """Return the weighted mean and inertia of the points of `box`."""
+        p, w = points[box], weights[box]
+        mean = np.dot(w, p) / np.sum(w)
+        inertia = np.dot(w, np.sum(np.square(p - mean), axis=1))
+        return mean, float(inertia)
+
+    @staticmethod
+    def _cut(points, weights, box):
+        """
+        Cut `box` along the channel of its points with the largest range, at
+        the weighted median.
+        """
+        p = points[box]
+        channel = np.argmax(np.ptp(p, axis=0))
+        order = np.argsort(p[:, channel], kind='stable')
+        cum = np.cumsum(weights[box][order])
+        cut = np.searchsorted(cum, cum[-1] / 2) + 1
+        cut = min(cut, len(order) - 1)
+        return box[order[:cut]], box[order[cut:]]
+
+    @staticmethod
+    def _split(points, weights, labels, centers):
+        """
+        Return initial centers for one more cluster than `centers`. The
+        cluster of highest inertia is split by adding a center on its point
+        the farthest from its current center.
+        """
+        dist = np.sum(np.square(points - centers[labels]), axis=1)
+        weighted = dist if weights is None else dist * weights
+        inertia = np.bincount(labels, weighted, minlength=len(centers))
 
-        return best
+        worst = labels == np.argmax(inertia)
+        farthest = np.argmax(np.where(worst, dist, -1))
+        return np.vstack((centers, points[farthest]))
 
     @staticmethod
     def _default_settings():
@@ -60,6 +288,12 @@ class Cluster(Task):
             'min_k': 2,
             'max_k': 7,
             'algorithm': 'kmeans',
+            'histogram': False,
+            'histogram.step': 8,
+            'warm_start': False,
+            'early_stop': 0,
+            'n_jobs': 1,
+            'random_state': None,
         }
 
     @staticmethod
@@ -0,0 +1,162 @@
+import atexit
+import queue
+import sys
+import threading
+from os.path import join
+
+import numpy as np
+
+
+class DebugSink(object):
+    """
+    Write the intermediate images of an image to `directory`, either as four
+    JPEG files (`fmt='jpeg'`) or as a single compressed npz archive
+    (`fmt='npz'`) whose masks are packed 8 pixels per byte, see `load`.
+    If `max_pending` is greater than 0, images are written by a background
+    thread and up to `max_pending` of them can wait to be written, further
+    ones being dropped. Errors are then written to stderr and counted, see
+    `stats`. Otherwise images are written before `put` returns, which raises
+    on errors.
+    """
+    def __init__(self, directory, fmt='jpeg', max_pending=0):
+        if fmt not in ('jpeg', 'npz'):
+            raise ValueError('Unknown debug format {}'.format(fmt))
+
+        self._directory = directory
+        self._fmt = fmt
+        self._max_pending = max_pending
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def put(self, name, imgs):
+        """
+        Write `imgs`, the intermediate images returned by `ImageToColor`
+        when debugging, under `name`. Return the paths of the files written,
+        by kind of image, or `None` if the images were dropped. When writing
+        in the background, the files may not be written yet.
+        """
+        if self._fmt == 'npz':
+            path = join(self._directory, name + '.npz')
+            paths = dict.fromkeys(('resized', 'back', 'skin', 'clusters'),
+                                  path)
+        else:
+            paths = {k: join(self._directory, '{}-{}.jpg'.format(name, k))
+                     for k in ('resized', 'back', 'skin', 'clusters')}
+
+        if self._max_pending <= 0:
+            self._write(paths, imgs)
+            with self._lock:
+                self.written += 1
+            return paths
+
+        with self._lock:
+            if self._thread is None:
+                self._start()
+        try:
+            self._queue.put_nowait((paths, imgs))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return None
+        return paths
+
+    def flush(self):
+        """Wait for the images queued to be written"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """Write the images queued and stop the background thread"""
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+
+        self._queue.put((None, None))
+        thread.join()
+
+    def stats(self):
+        """
+        Return the number of images written, dropped and failing to be
+        written in the background so far.
+        """
+        with self._lock:
+            return {'written': self.written, 'dropped': self.dropped,
+                    'errors': self.errors}
+
+    @staticmethod
+    def load(path):
+        """
+        Return the intermediate images stored in the npz archive at `path`,
+        with the masks unpacked.
+        """
+        with np.load(path) as f:
+            shape = tuple(f['shape'])
+            imgs = {'resized': f['resized'], 'clusters': f['clusters']}
+            for k in ('back', 'skin'):
+                bits = np.unpackbits(f[k])[:int(np.prod(shape))]
+                imgs[k] = bits.reshape(shape).astype(np.bool_)
+        return imgs
+
+    def _start(self):
+        self._queue = queue.Queue(self._max_pending)
+        self._thread = threading.Thread(target=self._run, name='debug')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            paths, imgs = self._queue.get()
+            try:
+                if paths is None:
+                    return
+                self._write(paths, imgs)
+            except Exception as e:
+                # Nothing to raise to, `put` has returned.
+                m = 'Unable to write debug images to {}: `{}`\n'.format(
+                    paths['resized'], e)
+                sys.stderr.write(m)
+                with self._lock:
+                    self.errors += 1
+            else:
+                with self._lock:
+                    self.written += 1
+            finally:
+                self._queue.task_done()
+
+    def _write(self, paths, imgs):
+        if self._fmt == 'npz':
+            DebugSink._write_npz(paths['resized'], imgs)
+        else:
+            DebugSink._write_jpeg(paths, imgs)
+
+    @staticmethod
+    def _write_jpeg(paths, imgs):
+        # Slow to import, only needed when debugging.
+        from skimage.io import imsave
+
+        for k in ('resized', 'back', 'skin', 'clusters'):
+            imsave(paths[k], DebugSink._to_ubyte(imgs[k]))
+
+    @staticmethod
+    def _write_npz(path, imgs):
+        np.savez_compressed(
+            path,
+            resized=DebugSink._to_ubyte(imgs['resized']),
+            clusters=DebugSink._to_ubyte(imgs['clusters']),
+            back=np.packbits(imgs['back']),
+            skin=np.packbits(imgs['skin']),
+            shape=np.array(imgs['back'].shape))
+
+    @staticmethod
+    def _to_ubyte(img):
+        if img.dtype == np.uint8:
+            return img
+        if img.dtype == np.bool_:
+            return img.astype(np.uint8) * 255
+        return (np.clip(img, 0, 1) * 255 + .5).astype(np.uint8)
@@ -2,3 +2,10 @@ class KMeansException(Exception):
     def __init__(self):
         message = 'Not enough pixels left to perform clustering.'
         super(KMeansException, self).__init__(message)
+
+
+class FetchException(Exception):
+    def __init__(self, message, retry=False):
+        super(FetchException, self).__init__(message)
+        # Whether trying again may succeed.
+        self.retry = retry
@@ -0,0 +1,321 @@
+import asyncio
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import build_opener, getproxies, proxy_bypass
+
+from .exceptions import FetchException
+
+
+class Fetcher(object):
+    """
+    Download HTTP and HTTPS resources on an `asyncio` event loop running in
+    a background thread. Connections are kept alive and reused per host, at
+    most `max_connections` requests run at once, of which at most
+    `max_per_host` to the same host. Idle connections are closed after
+    `idle_timeout` seconds, and the oldest ones once more than `max_idle`
+    are kept (`max_connections` if `None`). Each attempt must complete within
+    `timeout` seconds. Connection errors, timeouts and 429 or 5xx responses
+    are retried up to `retries` times, waiting `backoff` seconds before the
+    first retry and twice longer before each of the following ones.
+    URLs for which a proxy is configured in the environment (`HTTP_PROXY`,
+    `HTTPS_PROXY` and `NO_PROXY`) are downloaded with urllib on a thread
+    instead, within the same limits, without reusing connections.
+    A fetcher can be used by several threads at once.
+    """
+    def __init__(self, max_connections=16, max_per_host=4, timeout=30.,
+                 retries=3, backoff=0.5, idle_timeout=15., max_idle=None):
+        self._max_connections = max_connections
+        self._max_per_host = max_per_host
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._idle_timeout = idle_timeout
+        self._max_idle = max_connections if max_idle is None else max_idle
+
+        # Only touched from the loop, created there as some versions of
+        # asyncio bind semaphores to the loop they are created in.
+        self._limit = None
+        self._hosts = {}
+        self._ssl = None
+        # Idle connections of all hosts, oldest first, by writer.
+        self._idle = OrderedDict()
+        self._expiry = None
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    def get(self, url):
+        """Return the body of the response to a GET request on `url`"""
+        return self.submit(url).result()
+
+    def submit(self, url):
+        """
+        Start downloading `url` and return a `concurrent.futures.Future` of
+        its body.
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch(url),
+                                                self._started())
+
+    async def fetch(self, url):
+        """Coroutine returning the body of the response to `url`"""
+        proxied = Fetcher._proxied(url)
+        attempt = 0
+        while True:
+            try:
+                if proxied:
+                    return await self._urlopen(url)
+                return await self._follow(url)
+            except FetchException as e:
+                if not e.retry or attempt == self._retries:
+                    raise
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                if attempt == self._retries:
+                    m = 'Unable to fetch {}: {!r}'.format(url, e)
+                    raise FetchException(m) from e
+
+            await asyncio.sleep(self._backoff * 2 ** attempt)
+            attempt += 1
+
+    def close(self):
+        """Close idle connections and stop the event loop"""
+        with self._lock:
+            if self._loop is None:
+                return
+            loop, self._loop = self._loop, None
+
+        asyncio.run_coroutine_threadsafe(self._close_idle(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+
+    # Redirections followed before giving up.
+    _MAX_REDIRECTS = 5
+
+    # Statuses worth trying again.
+    _RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def _global_limit(self):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self._max_connections)
+        return self._limit
+
+    def _started(self):
+        """Return the event loop, starting it if needed"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name='fetcher',
+                    daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _follow(self, url):
+        """Request `url`, following redirections"""
+        for _ in range(Fetcher._MAX_REDIRECTS + 1):
+            status, headers, body = await self._request(url)
+
+            if status in (301, 302, 303, 307, 308) and 'location' in headers:
+                url = urljoin(url, headers['location'])
+                continue
+
+            if status >= 400:
+                m = 'Unable to fetch {}: HTTP {}'.format(url, status)
+                raise FetchException(m, status in Fetcher._RETRY_STATUSES)
+            return body
+
+        raise FetchException('Unable to fetch {}: too many '
+                             'redirections'.format(url))
+
+    async def _request(self, url):
+        """Return the status, headers and body of a GET request on `url`"""
+        u = urlsplit(url)
+        if u.scheme not in ('http', 'https'):
+            raise FetchException('Unsupported URL {}'.format(url))
+
+        port = u.port or (443 if u.scheme == 'https' else 80)
+        key = u.scheme, u.hostname, port
+        if key not in self._hosts:
+            self._hosts[key] = asyncio.Semaphore(self._max_per_host), []
+        limit, idle = self._hosts[key]
+        self._evict()
+
+        target = u.path or '/'
+        if u.query:
+            target += '?' + u.query
+        request = ('GET {} HTTP/1.1\r\nHost: {}\r\n'
+                   'User-Agent: color-extractor\r\n'
+                   'Accept-Encoding: identity\r\n\r\n').format(target,
+                                                                u.netloc)
+        request = request.encode('latin-1')
+
+        # The limit of the host is waited for first, so that requests queued
+        # for a busy host don't hold connections other hosts could use.
+        async with limit, self._global_limit():
+            # A pooled connection may have been closed by the server while
+            # idle, another one is used if nothing could be read from it.
+            while idle:
+                reader, writer = idle.pop()
+                del self._idle[writer]
+                try:
+                    response = await asyncio.wait_for(
+                        Fetcher._exchange(reader, writer, request, url),
+                        self._timeout)
+                except (ConnectionError, EOFError):
+                    continue
+                return self._release(key, reader, writer, response)
+
+            async def connect():
+                ctx = None
+                if u.scheme == 'https':
+                    if self._ssl is None:
+                        self._ssl = ssl.create_default_context()
+                    ctx = self._ssl
+                reader, writer = await asyncio.open_connection(
+                    u.hostname, port, ssl=ctx)
+                response = await Fetcher._exchange(reader, writer, request,
+                                                   url)
+                return reader, writer, response
+
+            reader, writer, response = await asyncio.wait_for(
+                connect(), self._timeout)
+            return self._release(key, reader, writer, response)
+
+    @staticmethod
+    async def _exchange(reader, writer, request, url):
+        """Send `request` and read its response, closing on failure"""
+        try:
+            writer.write(request)
+            return await Fetcher._response(reader)
+        except ValueError as e:
+            writer.close()
+            m = 'Unable to fetch {}: malformed response ({})'.format(url, e)
+            raise FetchException(m, True) from e
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _urlopen(self, url):
+        """Download `url` with urllib, which goes through proxies"""
+        def read():
+            try:
+                # Built each time to use the proxies currently configured.
+                with build_opener().open(url, timeout=self._timeout) as r:
+                    return r.read()
+            except HTTPError as e:
+                m = 'Unable to fetch {}: HTTP {}'.format(url, e.code)
+                raise FetchException(m, e.code in Fetcher._RETRY_STATUSES)
+
+        async with self._global_limit():
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, read)
+
+    @staticmethod
+    def _proxied(url):
+        """Whether a proxy is configured for `url` in the environment"""
+        u = urlsplit(url)
+        return (u.scheme in getproxies() and
+                not proxy_bypass(u.hostname or ''))
+
+    def _release(self, key, reader, writer, response):
+        """Put the connection back in the pool if it can be reused"""
+        status, headers, body, reusable = response
+        if reusable:
+            self._hosts[key][1].append((reader, writer))
+            self._idle[writer] = key, reader, time.monotonic()
+            self._evict()
+        else:
+            writer.close()
+        return status, headers, body
+
+    def _evict(self):
+        """
+        Close the connections idle for too long, and the oldest ones while
+        too many are idle. Wake up when the oldest one left expires.
+        """
+        now = time.monotonic()
+        while self._idle:
+            writer, (key, reader, since) = next(iter(self._idle.items()))
+            if (len(self._idle) <= self._max_idle and
+                    now - since < self._idle_timeout):
+                break
+            del self._idle[writer]
+            self._hosts[key][1].remove((reader, writer))
+            writer.close()
+
+        if self._idle and self._expiry is None:
+            since = next(iter(self._idle.values()))[2]
+            self._expiry = asyncio.get_event_loop().call_later(
+                since + self._idle_timeout - now, self._expire)
+
+    def _expire(self):
+        self._expiry = None
+        self._evict()
+
+    @staticmethod
+    async def _response(reader):
+        """
+        Read a response from `reader`. Return its status, headers, body and
+        whether the connection can be used for another request.
+        """
+        line = await reader.readline()
+        if not line:
+            raise EOFError('Connection closed')
+        version, status = line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = (version == 'HTTP/1.1' and
+                    headers.get('connection', '').lower() != 'close')
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await Fetcher._chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+
+        return status, headers, body, reusable
+
+    @staticmethod
+    async def _chunked(reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+        # Skip trailers.
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(chunks)
+
+    async def _close_idle(self):
+        for writer in self._idle:
+            writer.close()
+        self._idle.clear()
+        self._hosts = {}
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+
+def is_remote(uri):
+    """Whether `uri` is an URL the fetcher can download"""
+    return uri.startswith(('http://', 'https://'))
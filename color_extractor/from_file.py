@@ -1,49 +1,385 @@
-from os.path import basename, join, splitext
+import hashlib
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+from itertools import count, islice
+from math import ceil
+from os.path import basename, splitext
+from urllib.request import urlopen
 
-from skimage.io import imread, imsave
-from skimage.util import img_as_float
+import numpy as np
+from PIL import Image
 from skimage.color import gray2rgb
 
+from .cache import Cache
+from .debug import DebugSink
+from .fetch import Fetcher, is_remote
 from .image_to_color import ImageToColor
+from .resize import Resize
 from .task import Task
+from .timing import emit, new_record
 
 
 class FromFile(Task):
     def __init__(self, samples, labels, settings=None):
+        """
+        The possible settings are the ones of `ImageToColor` plus:
+            - debug: A directory where to write the intermediate images. If
+              `None` nothing is written.
+              (default: None)
+
+            - debug.format: 'jpeg' to write each intermediate image as a JPEG
+              file, or 'npz' to write them all in a single compressed archive
+              per image, masks packed 8 pixels per byte. See
+              `DebugSink.load`.
+              (default: 'jpeg')
+
+            - debug.sample: Write the intermediate images of 1 image out of
+              this many. No paths are returned for the others.
+              (default: 1)
+
+            - debug.max_pending: The number of images whose intermediate
+              images can wait to be written by a background thread. Further
+              ones are dropped and no paths are returned for them, and
+              errors are written to stderr. With 0, they are written before
+              returning and errors are raised.
+              (default: 0)
+
+            - draft: Let the decoder downscale images while decoding them,
+              to the smallest size still larger than the one required by the
+              'resize' settings. Decoding is much faster and uses much less
+              memory for large JPEG files. Other formats are decoded at full
+              size.
+              (default: False)
+
+            - cache: A SQLite file where to store the centers found in images.
+              Images whose bytes, settings, samples and labels didn't change
+              are then neither decoded nor processed again. The cache is not
+              used when debugging.
+              (default: None)
+
+            - cache.max_entries: The number of images the cache can hold. The
+              least recently used ones are evicted first.
+              (default: 1000000)
+
+            - cache.mode: 'use' to read and fill the cache, 'rebuild' to empty
+              it first or 'bypass' to ignore it.
+              (default: 'use')
+
+            - profile: See `ImageToColor`. The time spent decoding images is
+              measured as well.
+              (default: None)
+
+            - prefetch: The number of images read and decoded ahead in
+              `imap`, at least 1.
+              (default: 4)
+
+            - prefetch.workers: The number of threads reading and decoding
+              images ahead in `imap`.
+              (default: 2)
+
+            - fetch.max_connections: The maximum number of HTTP(S) downloads
+              running at once. Connections are kept alive and reused.
+              (default: 16)
+
+            - fetch.max_per_host: The maximum number of downloads running at
+              once from the same host.
+              (default: 4)
+
+            - fetch.timeout: The number of seconds a download attempt can
+              take.
+              (default: 30.)
+
+            - fetch.retries: The number of times a download failing because
+              of the network, a timeout or a 429 or 5xx response is tried
+              again.
+              (default: 3)
+
+            - fetch.backoff: The number of seconds to wait before the first
+              retry. The wait doubles for each following retry.
+              (default: 0.5)
+
+            - fetch.idle_timeout: The number of seconds a connection can be
+              kept alive without being used.
+              (default: 15.)
+
+            - fetch.max_idle: The maximum number of connections kept alive
+              without being used, over all hosts. The oldest ones are closed
+              first.
+              (default: 16)
+        """
         if settings is None:
             settings = {}
 
         super(FromFile, self).__init__(settings)
+        if self._settings['prefetch'] < 1:
+            m = 'Invalid prefetch {}, must be at least 1'
+            raise ValueError(m.format(self._settings['prefetch']))
+
         self._image_to_color = ImageToColor(samples, labels, self._settings)
+        self._resize = Resize(self._settings.get('resize'))
+        self._fetcher = Fetcher(self._settings['fetch.max_connections'],
+                                self._settings['fetch.max_per_host'],
+                                self._settings['fetch.timeout'],
+                                self._settings['fetch.retries'],
+                                self._settings['fetch.backoff'],
+                                self._settings['fetch.idle_timeout'],
+                                self._settings['fetch.max_idle'])
+
+        self._debug = None
+        self._debug_count = count()
+        if self._settings['debug'] is not None:
+            self._debug = DebugSink(self._settings['debug'],
+                                    self._settings['debug.format'],
+                                    self._settings['debug.max_pending'])
+
+        mode = self._settings['cache.mode']
+        if mode not in ('use', 'rebuild', 'bypass'):
+            raise ValueError('Unknown cache mode {}'.format(mode))
+
+        self._cache = None
+        if self._settings['cache'] is not None and mode != 'bypass':
+            self._cache = Cache(self._settings['cache'],
+                                self._fingerprint(samples, labels),
+                                self._settings['cache.max_entries'])
+            if mode == 'rebuild':
+                self._cache.clear()
 
     def get(self, uri):
-        i = imread(uri)
-        if len(i.shape) == 2:
-            i = gray2rgb(i)
+        r = new_record(self._settings['profile'])
+        c = self.centers(uri, r)
+        if self._settings['debug'] is None:
+            colors = self.name([c], r)[0]
         else:
-            i = i[:, :, :3]
-        c = self._image_to_color.get(i)
+            c, paths = c
+            colors = self.name([c], r)[0], paths
+
+        emit(self._settings['profile'], r)
+        return colors
+
+    def centers(self, uri, record=None):
+        """
+        Return the centers of the clusters selected in the image found at
+        `uri` without naming them. See `ImageToColor.centers`.
+        """
+        r = new_record(self._settings['profile']) if record is None else record
+        c = self._centers(uri, r)
+        if record is None:
+            emit(self._settings['profile'], r)
+        return c
+
+    def imap(self, uris, ordered=True, named=True):
+        """
+        Yield `(uri, colors)` for each path or URL of the iterable `uris`, or
+        `(uri, exception)` if the colors of the image couldn't be found.
+        Images are read and decoded ahead on 'prefetch.workers' threads
+        while the previous ones are processed, at most 'prefetch' of them
+        being held at once whatever the length of `uris`. Unless `ordered`,
+        images are processed as soon as they are decoded instead of in the
+        order of `uris`. Unless `named`, the centers returned by `centers`
+        are yielded instead of the colors, to name several images at once.
+        """
+        pool = ThreadPoolExecutor(self._settings['prefetch.workers'])
+        uris = iter(uris)
+        pending = deque()
+
+        def submit(uri):
+            r = new_record(self._settings['profile'])
+            # Downloads of all pending images run concurrently.
+            d = self._fetcher.submit(uri) if is_remote(uri) else None
+
+            def fetch():
+                # Don't count the time spent waiting for a thread.
+                r.restart()
+                return self._fetch(uri, r, None if d is None else d.result())
+
+            pending.append((uri, r, pool.submit(fetch), d))
+
+        try:
+            for uri in islice(uris, self._settings['prefetch']):
+                submit(uri)
+
+            while pending:
+                if not ordered:
+                    wait([p[2] for p in pending], return_when=FIRST_COMPLETED)
+                    pending.rotate(-next(i for i, p in enumerate(pending)
+                                         if p[2].done()))
+                uri, r, f, _ = pending.popleft()
+                for u in islice(uris, 1):
+                    submit(u)
+
+                try:
+                    fetched = f.result()
+                    r.restart()
+                    if named:
+                        result = self._colors(uri, fetched, r)
+                    else:
+                        result = self._process(uri, fetched, r)
+                except Exception as e:
+                    result = e
+
+                emit(self._settings['profile'], r)
+                yield uri, result
+        finally:
+            for _, _, f, d in pending:
+                f.cancel()
+                if d is not None:
+                    d.cancel()
+            pool.shutdown(wait=False)
+
+    def _colors(self, uri, fetched, record):
+        """Return what `get` returns given what `_fetch` returned"""
+        c = self._process(uri, fetched, record)
+        if self._settings['debug'] is None:
+            return self.name([c], record)[0]
+
+        c, paths = c
+        return self.name([c], record)[0], paths
+
+    def _centers(self, uri, record):
+        return self._process(uri, self._fetch(uri, record), record)
+
+    def _fetch(self, uri, record, data=None):
+        """
+        Do the I/O needed to process the image found at `uri`, whose bytes
+        can be given as `data` if already loaded. Return the cache key of the
+        image, its centers if they are cached and the decoded image
+        otherwise.
+        """
+        if self._cache is None or self._settings['debug'] is not None:
+            i = self._read(uri, data)
+            record.lap('decode')
+            return None, None, i
+
+        if data is None:
+            data = self._load(uri)
+        key = self._cache.key(data)
+        c = self._cache.get(key)
+        record['cached'] = int(c is not None)
+        record.lap('cache')
+        if c is not None:
+            return key, c, None
+
+        i = self._read(uri, data)
+        record.lap('decode')
+        return key, None, i
+
+    def _process(self, uri, fetched, record):
+        """Return the centers of an image given what `_fetch` returned"""
+        key, c, i = fetched
+        if c is not None:
+            return c
+
+        c = self._image_to_color.centers(i, record)
+        if key is not None:
+            self._cache.put(key, c)
+            record.lap('cache')
+            return c
 
         dbg = self._settings['debug']
         if dbg is None:
             return c
 
         c, imgs = c
-        b = splitext(basename(uri))[0]
-        imsave(join(dbg, b + '-resized.jpg'), imgs['resized'])
-        imsave(join(dbg, b + '-back.jpg'), img_as_float(imgs['back']))
-        imsave(join(dbg, b + '-skin.jpg'), img_as_float(imgs['skin']))
-        imsave(join(dbg, b + '-clusters.jpg'), imgs['clusters'])
-
-        return c, {
-            'resized': join(dbg, b + '-resized.jpg'),
-            'back': join(dbg, b + '-back.jpg'),
-            'skin': join(dbg, b + '-skin.jpg'),
-            'clusters': join(dbg, b + '-clusters.jpg'),
-        }
+        paths = None
+        if next(self._debug_count) % self._settings['debug.sample'] == 0:
+            paths = self._debug.put(splitext(basename(uri))[0], imgs)
+        record.lap('debug')
+
+        return c, paths
+
+    def name(self, centers, record=None):
+        """Name the centers of several images. See `ImageToColor.name`."""
+        return self._image_to_color.name(centers, record)
+
+    def cache_stats(self):
+        """Return the number of cache hits and misses so far"""
+        if self._cache is None:
+            return {'hits': 0, 'misses': 0}
+        return self._cache.stats()
+
+    def flush(self):
+        """Wait for the intermediate images queued to be written"""
+        if self._debug is not None:
+            self._debug.flush()
+
+    def _fingerprint(self, samples, labels):
+        """
+        Return a hash of everything but the image the centers depend on.
+        """
+        settings = self._image_to_color.settings()
+        settings['draft'] = self._settings['draft']
+        h = hashlib.sha256(json.dumps(settings, sort_keys=True,
+                                      default=repr).encode('utf-8'))
+        if samples is None:
+            # Opened from a 'model' of `Name`, identified by its fingerprint.
+            h.update(self._image_to_color._name.fingerprint().encode('utf-8'))
+        else:
+            h.update(np.ascontiguousarray(samples).tobytes())
+            h.update(np.asarray(labels, str).tobytes())
+        return h.hexdigest()
+
+    def _read(self, uri, data=None):
+        """
+        Decode the image found at `uri` as an RGB array. If already loaded,
+        the bytes of the image can be given as `data`.
+        """
+        if data is None and is_remote(uri):
+            data = self._load(uri)
+
+        if data is None and not self._settings['draft']:
+            from skimage.io import imread
+            i = imread(uri)
+        else:
+            i = self._decode(uri if data is None else BytesIO(data))
+
+        if len(i.shape) == 2:
+            return gray2rgb(i)
+        return i[:, :, :3]
+
+    def _decode(self, f):
+        if isinstance(f, str) and '://' in f:
+            f = BytesIO(self._load(f))
+
+        img = Image.open(f)
+        rows = self._resize.min_rows()
+        if self._settings['draft'] and img.height > rows:
+            cols = int(ceil(img.width * rows / img.height))
+            img.draft(img.mode, (cols, rows))
+
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            img = img.convert('RGB')
+        return np.asarray(img)
+
+    def _load(self, uri):
+        """Return the bytes of the file found at `uri`"""
+        if is_remote(uri):
+            return self._fetcher.get(uri)
+        if '://' in uri:
+            return urlopen(uri).read()
+        with open(uri, 'rb') as f:
+            return f.read()
 
     @staticmethod
     def _default_settings():
         return {
             'debug': None,
+            'debug.format': 'jpeg',
+            'debug.sample': 1,
+            'debug.max_pending': 0,
+            'draft': False,
+            'cache': None,
+            'cache.max_entries': 1000000,
+            'cache.mode': 'use',
+            'profile': None,
+            'prefetch': 4,
+            'prefetch.workers': 2,
+            'fetch.max_connections': 16,
+            'fetch.max_per_host': 4,
+            'fetch.timeout': 30.,
+            'fetch.retries': 3,
+            'fetch.backoff': 0.5,
+            'fetch.idle_timeout': 15.,
+            'fetch.max_idle': 16,
         }
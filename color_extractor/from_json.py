@@ -1,7 +1,7 @@
 import json
+import re
 import sys
-
-import ijson
+from concurrent.futures import ThreadPoolExecutor
 
 from .from_file import FromFile
 from .task import Task
@@ -10,6 +10,39 @@ from .task import Task
 class FromJson(Task):
     def __init__(self, image_field, samples, labels,
                  colors_field='_color_tags', settings=None):
+        """
+        The possible settings are the ones of `FromFile` plus:
+            - name_batch: The number of images whose colors are named at once.
+              The output following an image is held back until its colors
+              are named.
+              (default: 1)
+
+            - workers: The number of threads processing images. When greater
+              than 1, images are dispatched to the threads as soon as they are
+              read while the JSON keeps being parsed.
+              (default: 1)
+
+            - max_pending: The maximum number of images being processed or
+              waiting to be written when using several workers. Parsing waits
+              for the oldest images once it is reached, bounding memory usage.
+              (default: 64)
+
+            - lines: Whether the input is JSON Lines, one record per line.
+              Each record is enriched with the colors of the image found in
+              its top-level image field, and written back on its own line.
+              (default: False)
+
+            - passthrough: Whether to copy the text of the input through
+              unchanged, only adding the colors after the images, instead of
+              re-encoding every token. Ignored when the image field contains
+              a dot, which only the token by token mode matches against the
+              path of the values.
+              (default: True)
+
+            - buffer_size: The number of characters held before being written
+              to the output at once.
+              (default: 65536)
+        """
         if settings is None:
             settings = {}
 
@@ -18,38 +51,285 @@ class FromJson(Task):
         self._colors_field = colors_field
         self._from_file = FromFile(samples, labels, self._settings)
 
+        self._pool = None
+        if self._settings['workers'] > 1:
+            self._pool = ThreadPoolExecutor(self._settings['workers'])
+
     def get(self, handle, out=sys.stdout):
+        """
+        Read JSON from `handle` and write it to `out` with the colors of the
+        images added.
+        """
+        out = _Buffer(out, self._settings['buffer_size'])
+        w = _Writer(out, self._from_file, self._colors_field,
+                    self._settings['name_batch'], self._pool,
+                    self._settings['max_pending'],
+                    self._settings.get('debug') is not None)
+        if self._settings['lines']:
+            self._get_lines(handle, w)
+        elif self._settings['passthrough'] and '.' not in self._image_field:
+            self._get_passthrough(handle, w)
+        else:
+            self._get_tokens(handle, w)
+
+        w.flush()
+        out.flush()
+
+    def cache_stats(self):
+        """Return the number of cache hits and misses so far"""
+        return self._from_file.cache_stats()
+
+    # The text before a string, the string and, if it is a key whose value is
+    # a string, that value. Matched from outside of any string only.
+    _STRING = re.compile(r'[^"]*"([^"\\]*(?:\\.[^"\\]*)*)"'
+                         r'(?:\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)")?')
+
+    # What can follow a key at the end of a chunk when its value is not read
+    # yet.
+    _KEY_END = re.compile(r'\s*(?::\s*(?:"[^"\\]*(?:\\.[^"\\]*)*\\?)?)?\Z')
+
+    # The number of characters read at once when copying the input through.
+    _CHUNK = 1 << 20
+
+    def _get_lines(self, handle, w):
+        for i, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                m = 'Invalid JSON on line {}: `{}`\n'.format(i, e)
+                sys.stderr.write(m)
+                w.write(line + '\n')
+                continue
+
+            uri = None
+            if isinstance(record, dict):
+                uri = record.get(self._image_field)
+            if isinstance(uri, str):
+                # Add the colors before the closing brace of the record.
+                w.write(line[:-1])
+                w.add_image(uri)
+                w.write('}\n')
+            else:
+                w.write(line + '\n')
+
+    def _get_passthrough(self, handle, w):
+        """
+        Copy the text of `handle` through unchanged, adding the colors after
+        the string values of the keys ending with the image field. Only the
+        strings are scanned, the text between them is copied as is.
+        """
+        buf = ''
+        while True:
+            chunk = handle.read(FromJson._CHUNK)
+            buf += chunk
+            pos = written = 0
+            while True:
+                m = FromJson._STRING.match(buf, pos)
+                if m is None:
+                    break
+                key, value = m.group(1, 2)
+                if (value is None and chunk and
+                        FromJson._KEY_END.match(buf, m.end())):
+                    # The value of the key may be in the next chunk.
+                    break
+
+                pos = m.end()
+                if (value is not None and
+                        FromJson._decode(key).endswith(self._image_field)):
+                    w.write(buf[written:pos])
+                    w.add_image(FromJson._decode(value))
+                    written = pos
+
+            w.write(buf[written:pos])
+            buf = buf[pos:]
+            if not chunk:
+                w.write(buf)
+                return
+
+    def _get_tokens(self, handle, w):
+        """Re-encode the JSON of `handle` token by token"""
+        import ijson
+
         prev_event = 'start_map'
         for prefix, event, value in ijson.parse(handle):
-            FromJson._put_comma(event, prev_event, out)
+            FromJson._put_comma(event, prev_event, w)
             if event.startswith('start_'):
-                out.write('{' if event == 'start_map' else '[')
+                w.write('{' if event == 'start_map' else '[')
             elif event.startswith('end_'):
-                out.write('}' if event == 'end_map' else ']')
+                w.write('}' if event == 'end_map' else ']')
             elif event == 'map_key':
-                out.write('{}:'.format(json.dumps(value)))
+                w.write('{}:'.format(json.dumps(value)))
             elif event == 'number':
-                out.write(str(value))
+                w.write(str(value))
             else:
-                out.write(json.dumps(value))
+                w.write(json.dumps(value))
 
             if event == 'string' and prefix.endswith(self._image_field):
-                self._add_colors_tags(value, out)
+                w.add_image(value)
 
             prev_event = event
 
-    def _add_colors_tags(self, uri, out):
-        try:
-            colors = self._from_file.get(uri)
-        except Exception as e:
-            colors = []
-            m = 'Unable to find colors for {}: `{}`\n'.format(uri, e)
-            sys.stderr.write(m)
-
-        out.write(',"{}":{}'.format(self._colors_field, json.dumps(colors)))
+    @staticmethod
+    def _decode(s):
+        """Decode the content of a JSON string if it has escapes"""
+        if '\\' not in s:
+            return s
+        return json.loads('"{}"'.format(s))
 
     @staticmethod
     def _put_comma(ev, prev, out):
         if (ev != 'end_array' and ev != 'end_map' and prev != 'start_map' and
                 prev != 'start_array' and prev != 'map_key'):
             out.write(',')
+
+    @staticmethod
+    def _default_settings():
+        return {
+            'name_batch': 1,
+            'workers': 1,
+            'max_pending': 64,
+            'lines': False,
+            'passthrough': True,
+            'buffer_size': 1 << 16,
+        }
+
+
+class _Buffer(object):
+    """Write to `out` by chunks of at least `size` characters"""
+    def __init__(self, out, size):
+        self._out = out
+        self._size = size
+        self._parts = []
+        self._length = 0
+
+    def write(self, s):
+        self._parts.append(s)
+        self._length += len(s)
+        if self._length >= self._size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self._out.write(''.join(self._parts))
+            self._parts = []
+            self._length = 0
+
+
+class _Writer(object):
+    """
+    Write enriched JSON to `out`. The colors of the images are named by
+    batches of `batch` images, everything written after an image whose
+    colors are not named yet is held back to keep the output in order.
+    If `pool` is given, images are processed on it and up to `max_pending`
+    images can wait to be written. If `debug`, the colors are written along
+    with the paths of the intermediate images.
+    """
+    def __init__(self, out, from_file, colors_field, batch, pool=None,
+                 max_pending=0, debug=False):
+        self._out = out
+        self._debug = debug
+        self._from_file = from_file
+        self._colors_field = colors_field
+        self._batch = batch
+        self._pool = pool
+        self._max_pending = batch if pool is None else max(max_pending, batch)
+        self._chunks = []
+        self._images = []
+
+    def write(self, s):
+        if self._images:
+            self._chunks.append(s)
+        else:
+            self._out.write(s)
+
+    def add_image(self, uri):
+        tags = _Tags(uri, self._debug)
+        if self._pool is None:
+            tags.compute(self._from_file)
+        else:
+            tags.future = self._pool.submit(self._from_file.centers, uri)
+
+        self._chunks.append(tags)
+        self._images.append(tags)
+        while (len(self._images) >= self._max_pending or
+               self._head_done()):
+            self._write_head()
+
+    def flush(self):
+        while self._images:
+            self._write_head()
+
+        for c in self._chunks:
+            self._out.write(c)
+        self._chunks = []
+
+    def _head_done(self):
+        """Whether the oldest batch of images is ready to be named"""
+        if self._pool is None or len(self._images) < self._batch:
+            return False
+        return all(t.future.done() for t in self._images[:self._batch])
+
+    def _write_head(self):
+        """
+        Name the oldest batch of images and write everything up to the next
+        image.
+        """
+        head = self._images[:self._batch]
+        for t in head:
+            t.wait()
+
+        found = [t for t in head if t.centers is not None]
+        colors = self._from_file.name([t.centers for t in found])
+        for t, c in zip(found, colors):
+            t.colors = c
+
+        rest = self._images[len(head):]
+        stop = self._chunks.index(rest[0]) if rest else len(self._chunks)
+        for c in self._chunks[:stop]:
+            if isinstance(c, _Tags):
+                c = ',"{}":{}'.format(self._colors_field, c.dumps())
+            self._out.write(c)
+
+        self._chunks = self._chunks[stop:]
+        self._images = rest
+
+
+class _Tags(object):
+    """
+    The colors to add to the JSON after the image found at `uri`, along with
+    the paths of its intermediate images if `debug`, `None` when they were
+    not written.
+    """
+    def __init__(self, uri, debug=False):
+        self.uri = uri
+        self.debug = debug
+        self.future = None
+        self.centers = None
+        self.paths = None
+        self.colors = []
+
+    def compute(self, from_file):
+        self._resolve(from_file.centers, self.uri)
+
+    def wait(self):
+        if self.future is not None:
+            self._resolve(self.future.result)
+            self.future = None
+
+    def dumps(self):
+        if self.debug:
+            return json.dumps((self.colors, self.paths))
+        return json.dumps(self.colors)
+
+    def _resolve(self, centers, *args):
+        try:
+            self.centers = centers(*args)
+            if isinstance(self.centers, tuple):
+                self.centers, self.paths = self.centers
+        except Exception as e:
+            m = 'Unable to find colors for {}: `{}`\n'.format(self.uri, e)
+            sys.stderr.write(m)
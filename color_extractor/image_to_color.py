@@ -1,4 +1,9 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
 import numpy as np
+from skimage.util import img_as_float
 
 from .back import Back
 from .cluster import Cluster
@@ -7,49 +12,267 @@ from .resize import Resize
 from .selector import Selector
 from .skin import Skin
 from .task import Task
+from .timing import emit, new_record
 
 
 class ImageToColor(Task):
     def __init__(self, samples, labels, settings=None):
+        """
+        The possible settings are:
+            - {resize,back,skin,cluster,selector,name}: The settings of each
+              step.
+              (default: {})
+
+            - precision: The type images are carried as through the
+              pipeline once resized, either 'float64', 'float32' or 'uint8'.
+              Smaller types lower memory traffic and peak memory, especially
+              with large 'rows' values, and may change a few colors. Pixels
+              are still clustered as 'float64'. Overrides the 'precision' of
+              the resize settings.
+              (default: 'float64')
+
+            - debug: Return the intermediate images along with the colors if
+              not `None`.
+              (default: None)
+
+            - prefetch: The number of images `imap` takes ahead from its
+              input, at least 1.
+              (default: 4)
 
+            - profile: A collector receiving for each image the wall time of
+              each step, the number of pixels left after masking and the
+              number of clusters found. A collector is an object with an
+              `add` method accepting a `dict`, see `timing.Histogram`,
+              `timing.JsonLines` and `timing.Callback`. Nothing is measured if
+              `None`.
+              (default: None)
+        """
         if settings is None:
             settings = {}
 
         super(ImageToColor, self).__init__(settings)
-        self._resize = Resize(self._settings['resize'])
+        if self._settings['prefetch'] < 1:
+            m = 'Invalid prefetch {}, must be at least 1'
+            raise ValueError(m.format(self._settings['prefetch']))
+
+        self._resize = Resize(dict(self._settings['resize'],
+                                   precision=self._settings['precision']))
         self._back = Back(self._settings['back'])
-        self._skin = Skin(self._settings['skin'])
+        # Skin detection is skipped altogether when disabled.
+        self._skin = None
+        if self._settings['skin'].get('skin_type') != 'none':
+            self._skin = Skin(self._settings['skin'])
         self._cluster = Cluster(self._settings['cluster'])
         self._selector = Selector(self._settings['selector'])
         self._name = Name(samples, labels, self._settings['name'])
 
     def get(self, img):
+        r = new_record(self._settings['profile'])
+        c = self.centers(img, r)
+        if self._settings['debug'] is None:
+            colors = self.name([c], r)[0]
+        else:
+            c, imgs = c
+            colors = self.name([c], r)[0], imgs
+
+        emit(self._settings['profile'], r)
+        return colors
+
+    def centers(self, img, record=None):
+        """
+        Return the centers of the clusters selected in `img` without naming
+        them. The centers of many images can then be named at once using
+        `name`. When debugging, the intermediate images are returned as well.
+        Measurements are added to `record` if given, otherwise to a new
+        record given to the 'profile' collector.
+        """
+        r = new_record(self._settings['profile']) if record is None else record
         resized = self._resize.get(img)
-        back_mask = self._back.get(resized)
-        skin_mask = self._skin.get(resized)
+        r.lap('resize')
+        back_mask = self._back.get(resized, r)
+        r.lap('back')
+        skin_mask = self._skin_mask(resized)
+        r.lap('skin')
+        c = self._select(resized, back_mask, skin_mask, r)
+
+        if record is None:
+            emit(self._settings['profile'], r)
+        return c
+
+    def imap(self, images):
+        """
+        Yield `(i, colors)` for each image of the iterable `images`, `i` being
+        its position, or `(i, exception)` if its colors couldn't be found.
+        Images are taken from `images` on a background thread while the
+        previous ones are processed, at most 'prefetch' of them being held
+        at once. Producing images, e.g. decoding them in a generator, then
+        overlaps with processing them.
+        """
+        pool = ThreadPoolExecutor(1)
+        images = iter(images)
+        end = object()
+        pending = deque(pool.submit(next, images, end)
+                        for _ in range(self._settings['prefetch']))
+
+        try:
+            for i in count():
+                img = pending.popleft().result()
+                if img is end:
+                    return
+
+                pending.append(pool.submit(next, images, end))
+                try:
+                    result = self.get(img)
+                except Exception as e:
+                    result = e
+                yield i, result
+        finally:
+            for f in pending:
+                f.cancel()
+            pool.shutdown(wait=False)
+
+    def get_batch(self, images, errors=False):
+        """
+        Return the colors of each of `images`, exactly as calling `get` on
+        each image would. Images are stacked by shape once resized, and the
+        background and skin detections run on whole stacks. Clustering is
+        still done image per image, and naming is done once for all images.
+        If `errors`, the exception raised while resizing or clustering an
+        image is returned in place of its colors, the other images being
+        still processed, instead of being raised.
+        """
+        r = new_record(self._settings['profile'])
+        r['images'] = len(images)
+        resized = [ImageToColor._attempt(self._resize.get, errors, i)
+                   for i in images]
+        r.lap('resize')
+        stacks = {}
+        for i, img in enumerate(resized):
+            if not isinstance(img, Exception):
+                stacks.setdefault(img.shape, []).append(i)
+
+        masks = [None] * len(images)
+        for indices in stacks.values():
+            stack = np.stack([resized[i] for i in indices])
+            back_masks = self._back.get_batch(stack, r)
+            r.lap('back')
+            skin_masks = self._skin_mask(stack)
+            r.lap('skin')
+            for i, b, s in zip(indices, back_masks, skin_masks):
+                masks[i] = b, s
+
+        # Clustering is measured image per image.
+        selected = []
+        for img, m in zip(resized, masks):
+            if m is None:
+                selected.append(img)
+                continue
+            ri = new_record(self._settings['profile'])
+            selected.append(ImageToColor._attempt(self._select, errors, img,
+                                                  m[0], m[1], ri))
+            emit(self._settings['profile'], ri)
+        r.restart()
+
+        found = [i for i, c in enumerate(selected)
+                 if not isinstance(c, Exception)]
+        colors = list(selected)
+        if self._settings['debug'] is None:
+            named = self.name([selected[i] for i in found], r)
+        else:
+            named = self.name([selected[i][0] for i in found], r)
+            named = [(c, selected[i][1]) for i, c in zip(found, named)]
+        for i, c in zip(found, named):
+            colors[i] = c
+
+        emit(self._settings['profile'], r)
+        return colors
+
+    @staticmethod
+    def _attempt(step, errors, *args):
+        """Return what `step` returns, or what it raises if `errors`"""
+        try:
+            return step(*args)
+        except Exception as e:
+            if not errors:
+                raise
+            return e
+
+    def settings(self):
+        """Return the settings of every step, defaults included."""
+        return {
+            'resize': self._resize._settings,
+            'back': self._back._settings,
+            'skin': self._skin_settings(),
+            'cluster': self._cluster._settings,
+            'selector': self._selector._settings,
+            'name': self._name._settings,
+        }
+
+    def _skin_mask(self, imgs):
+        """Return the skin masks of an image or of a stack of images"""
+        if self._skin is None:
+            return np.zeros(imgs.shape[:-1], np.bool_)
+        if imgs.ndim == 4:
+            return self._skin.get_batch(imgs)
+        return self._skin.get(imgs)
+
+    def _skin_settings(self):
+        if self._skin is None:
+            return dict(Skin._default_settings(), **self._settings['skin'])
+        return self._skin._settings
+
+    def _select(self, resized, back_mask, skin_mask, record):
         mask = back_mask | skin_mask
-        k, labels, clusters_centers = self._cluster.get(resized[~mask])
+        # K-Means is faster on float64 whatever the precision.
+        pixels = img_as_float(resized[~mask]).astype(np.float64, copy=False)
+        record['pixels'] = len(pixels)
+        k, labels, clusters_centers = self._cluster.get(pixels)
+        record['k'] = k
+        record.lap('cluster')
         centers = self._selector.get(k, labels, clusters_centers)
-        colors = [self._name.get(c) for c in centers]
-        flattened = list({c for l in colors for c in l})
+        record.lap('selector')
 
         if self._settings['debug'] is None:
-            return flattened
+            return centers
 
-        colored_labels = np.zeros((labels.shape[0], 3), np.float64)
-        for i, c in enumerate(clusters_centers):
-            colored_labels[labels == i] = c
+        dtype = np.float32 if resized.dtype == np.uint8 else resized.dtype
+        clusters = np.zeros(resized.shape, dtype)
+        clusters[~mask] = clusters_centers[labels]
+        record.lap('debug')
 
-        clusters = np.zeros(resized.shape, np.float64)
-        clusters[~mask] = colored_labels
-
-        return flattened, {
+        return centers, {
             'resized': resized,
             'back': back_mask,
             'skin': skin_mask,
             'clusters': clusters
         }
 
+    def name(self, centers, record=None):
+        """
+        Return the color names of several images given the centers returned
+        by `centers` for each of them. All centers are named in a single
+        call to the classifier. Naming time is added to `record` if given,
+        otherwise to a new record given to the 'profile' collector.
+        """
+        if not centers:
+            return []
+
+        r = new_record(self._settings['profile']) if record is None else record
+
+        colors = self._name.get_many(np.concatenate(centers))
+        flattened = []
+        start = 0
+        for c in centers:
+            stop = start + len(c)
+            flattened.append(list({n for l in colors[start:stop] for n in l}))
+            start = stop
+
+        r.lap('name')
+        if record is None:
+            r['images'] = len(centers)
+            emit(self._settings['profile'], r)
+        return flattened
+
     @staticmethod
     def _default_settings():
         return {
@@ -59,4 +282,8 @@ class ImageToColor(Task):
             'cluster': {},
             'selector': {},
             'name': {},
+            'precision': 'float64',
+            'profile': None,
+            'debug': None,
+            'prefetch': 4,
         }
@@ -1,8 +1,12 @@
+import hashlib
+import json
+from os import makedirs
+from os.path import isfile, join
+
 import numpy as np
 from numpy.linalg import norm
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.preprocessing import StandardScaler
 
+from .quantize import cell_centers, cell_index, grid_size
 from .task import Task
 
 
@@ -13,6 +17,8 @@ class Name(Task):
     should be the name of the color ('red', 'blue'...).
     Samples must be a `numpy` array of shape `(n_colors, 3)`.
     Labels must be a `numpy` array of `str` of shape `(n_colors,)`.
+    A fitted classifier can be saved with `save` and opened again with the
+    'model' setting, in which case samples and labels can be `None`.
     """
     def __init__(self, samples, labels, settings=None):
         """
@@ -47,14 +53,130 @@ class Name(Task):
 
             - classifier.scale: Use scikit-learn `StandardScaler` prior to
               train the model and classifying samples.
+
+            - lut: Classify once every cell of a quantized RGB cube, including
+              the 'hard_monochrome' rules, and name colors by looking up their
+              cell instead of running the classifier.
+              (default: False)
+
+            - lut.step: The width of the cells of the lookup table along each
+              channel, in the `[0, 255]` range. A smaller step gives names
+              closer to the classifier at the cost of a bigger table.
+              (default: 4)
+
+            - lut.path: A `.npy` file where the lookup table is saved once
+              built, along with the fingerprint of the classifier in the same
+              path followed by `.fingerprint`. If the file already exists it
+              is memory-mapped instead of being built, and a `ValueError` is
+              raised if it was built from other samples, labels or settings.
+              (default: None)
+
+            - model: A directory written by `save`. The classifier, the
+              samples, the color names and the lookup table are
+              memory-mapped from it read-only instead of being fitted, so
+              that processes opening the same model share a single copy.
+              `samples` and `labels` are ignored, and the settings saved with
+              the model are used. Other settings given must match them.
+              (default: None)
         """
         if settings is None:
             settings = {}
 
         super(Name, self).__init__(settings)
 
+        if self._settings['model'] is not None:
+            self._open(self._settings['model'], settings)
+        else:
+            self._fit(samples, labels)
+
+    def get(self, sample):
+        """Return the color names for `sample`"""
+        if self._lut is not None:
+            i = cell_index(sample, self._settings['lut.step'])
+            return self._label_names(self._lut[i])
+
+        labels = []
+        sample = sample * 255
+
+        if self._settings['hard_monochrome']:
+            labels = self._hard_monochrome(sample)
+            if labels:
+                return labels
+
+        if self._settings['classifier.scale']:
+            sample = self._scaler.transform(sample)
+
+        sample = sample.reshape((1, -1))
+        labels += [self._names[i] for i in self._classifier.predict(sample)]
+        return labels
+
+    def get_many(self, samples):
+        """
+        Return the color names for each row of `samples`, an array of shape
+        `(n, 3)`. All samples are classified at once.
+        """
+        samples = np.asarray(samples)
+        if len(samples) == 0:
+            return []
+
+        samples = samples.reshape((len(samples), -1))
+        if self._lut is not None:
+            codes = self._lut[cell_index(samples, self._settings['lut.step'])]
+        else:
+            codes = self._codes(samples * 255)
+
+        return [self._label_names(c) for c in codes]
+
+    def fingerprint(self):
+        """
+        Return a hash of the samples, labels and settings the classifier was
+        fitted with.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha256(json.dumps(
+                self._model_settings(), sort_keys=True,
+                default=repr).encode('utf-8'))
+            h.update(np.ascontiguousarray(self._samples).tobytes())
+            h.update(np.asarray(self._names, str).tobytes())
+            h.update(np.asarray(self._labels, np.int64).tobytes())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def save(self, path):
+        """
+        Save the fitted classifier to the directory `path`, to be opened with
+        the 'model' setting. The directory holds the samples, the label of
+        each sample, the fitted classifier, the lookup table if any and a
+        `manifest.json` with the color names, the settings and the
+        fingerprint. Arrays are stored uncompressed to be memory-mapped.
+        """
+        import joblib
+
+        makedirs(path, exist_ok=True)
+        np.save(join(path, 'samples.npy'), np.asarray(self._samples))
+        np.save(join(path, 'labels.npy'),
+                np.asarray(self._labels, np.int32))
+        joblib.dump({'classifier': self._classifier, 'scaler': self._scaler},
+                    join(path, 'classifier.joblib'))
+        if self._lut is not None:
+            np.save(join(path, 'lut.npy'), np.asarray(self._lut))
+
+        # Written last, a model without manifest is incomplete.
+        manifest = {
+            'format': Name._MODEL_FORMAT,
+            'fingerprint': self.fingerprint(),
+            'names': np.asarray(self._names).tolist(),
+            'settings': json.loads(json.dumps(self._model_settings(),
+                                              default=repr)),
+        }
+        with open(join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    def _fit(self, samples, labels):
+        # scikit-learn modules are imported only when used.
         algo = self._settings['algorithm']
         if algo == 'knn':
+            from sklearn.neighbors import KNeighborsClassifier
             self._settings['classifier.scale'] = False
             args = self._settings['classifier.args'] or Name._knn_args()
             type_ = KNeighborsClassifier
@@ -66,29 +188,57 @@ class Name(Task):
 
         self._classifier = type_(**args)
         self._names, labels = np.unique(labels, return_inverse=True)
+        self._samples, self._labels = samples, labels
+        self._fingerprint = None
 
+        self._scaler = None
         if self._settings['classifier.scale']:
+            from sklearn.preprocessing import StandardScaler
             self._scaler = StandardScaler()
             samples = self._scaler.fit_transform(samples)
 
         self._classifier.fit(samples, labels)
 
-    def get(self, sample):
-        """Return the color names for `sample`"""
-        labels = []
-        sample = sample * 255
+        self._lut = None
+        if self._settings['lut']:
+            self._lut = self._load_lut()
 
-        if self._settings['hard_monochrome']:
-            labels = self._hard_monochrome(sample)
-            if labels:
-                return labels
+    def _open(self, path, settings):
+        """Open the model saved in the directory `path`"""
+        import joblib
 
-        if self._settings['classifier.scale']:
-            sample = self._scaler.transform(sample)
+        try:
+            with open(join(path, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError('Unable to open model {}: {}'.format(path, e))
+        if manifest.get('format') != Name._MODEL_FORMAT:
+            raise ValueError('Unknown model format in {}'.format(path))
 
-        sample = sample.reshape((1, -1))
-        labels += [self._names[i] for i in self._classifier.predict(sample)]
-        return labels
+        saved = manifest['settings']
+        for k, v in settings.items():
+            v = json.loads(json.dumps(v, default=repr))
+            if k in saved and v != saved[k]:
+                m = 'Model {} was saved with {} {!r}, not {!r}'
+                raise ValueError(m.format(path, k, saved[k], v))
+        self._settings.update(saved)
+
+        model = joblib.load(join(path, 'classifier.joblib'), mmap_mode='r')
+        self._classifier = model['classifier']
+        self._scaler = model['scaler']
+        self._names = np.array(manifest['names'])
+        self._samples = np.load(join(path, 'samples.npy'), mmap_mode='r')
+        self._labels = np.load(join(path, 'labels.npy'), mmap_mode='r')
+        self._fingerprint = manifest['fingerprint']
+
+        self._lut = None
+        if self._settings['lut']:
+            self._lut = np.load(join(path, 'lut.npy'), mmap_mode='r')
+
+    def _model_settings(self):
+        """Return the settings the classifier depends on"""
+        return {k: v for k, v in self._settings.items()
+                if k not in ('model', 'lut.path')}
 
     def _hard_monochrome(self, sample):
         """
@@ -113,6 +263,113 @@ class Name(Task):
 
         return colors
 
+    def _codes(self, samples):
+        """
+        Classify `samples`, an array of shape `(n, 3)` in the `[0, 255]`
+        range, in a single pass. Return for each sample a code to be given to
+        `_label_names`.
+        """
+        codes = np.empty(len(samples), np.intp)
+        todo = np.ones(len(samples), np.bool_)
+
+        if self._settings['hard_monochrome']:
+            mono = Name._monochrome_codes(samples)
+            todo = mono < 0
+            codes[~todo] = mono[~todo] + len(self._names)
+
+        if np.any(todo):
+            samples = samples[todo]
+            if self._settings['classifier.scale']:
+                samples = self._scaler.transform(samples)
+            codes[todo] = self._classifier.predict(samples)
+
+        return codes
+
+    def _label_names(self, code):
+        """Return the color names corresponding to a code of `_codes`"""
+        if code < len(self._names):
+            return [self._names[code]]
+
+        keys = Name._MONOCHROME[code - len(self._names)]
+        return [self._settings[k] for k in keys]
+
+    def _load_lut(self):
+        """
+        Return the lookup table, built by classifying the cells by chunks of
+        `_LUT_CHUNK` or opened from 'lut.path'. The fingerprint of the
+        classifier is saved next to the table, in 'lut.path' followed by
+        `.fingerprint`, and must match for the table to be reused.
+        """
+        step = self._settings['lut.step']
+        path = self._settings['lut.path']
+        n_cells = grid_size(step) ** 3
+
+        if path is not None and isfile(path):
+            lut = np.load(path, mmap_mode='r')
+            if lut.shape != (n_cells,):
+                m = 'Lookup table {} was not built with lut.step {}'
+                raise ValueError(m.format(path, step))
+            try:
+                with open(path + '.fingerprint') as f:
+                    fingerprint = f.read().strip()
+            except OSError:
+                fingerprint = None
+            if fingerprint != self.fingerprint():
+                m = ('Lookup table {} was not built with the same samples, '
+                     'labels and settings')
+                raise ValueError(m.format(path))
+            return lut
+
+        n_codes = len(self._names) + len(Name._MONOCHROME)
+        dtype = np.uint16 if n_codes <= np.iinfo(np.uint16).max else np.int32
+        lut = np.empty(n_cells, dtype)
+        for start in range(0, n_cells, Name._LUT_CHUNK):
+            stop = min(start + Name._LUT_CHUNK, n_cells)
+            lut[start:stop] = self._codes(cell_centers(step, start, stop))
+
+        if path is not None:
+            np.save(path, lut)
+            with open(path + '.fingerprint', 'w') as f:
+                f.write(self.fingerprint() + '\n')
+
+        return lut
+
+    @staticmethod
+    def _monochrome_codes(samples):
+        """
+        Vectorized version of `_hard_monochrome`. Return for each sample the
+        index in `_MONOCHROME` of its monochrome colors, or `-1` if the sample
+        is not monochrome.
+        """
+        gray_proj = np.outer(samples.dot(Name._GRAY_UNIT), Name._GRAY_UNIT)
+        gray_dist = norm(samples - gray_proj, axis=1)
+        luminance = samples.dot(Name._GRAY_COEFF)
+
+        gray = (luminance > 45) & (luminance < 170)
+        black = luminance <= 50
+        white = luminance >= 170
+
+        codes = np.where(black, np.where(gray, 3, 1), 0)
+        codes[white] = 2
+        codes[gray_dist > 15] = -1
+        return codes
+
+    # Settings naming the colors `_hard_monochrome` can return, in the order
+    # they are returned.
+    _MONOCHROME = (
+        ('gray_name',),
+        ('black_name',),
+        ('white_name',),
+        ('gray_name', 'black_name'),
+    )
+
+    # Number of cells of the lookup table classified at once, bounding the
+    # memory used to build it.
+    _LUT_CHUNK = 1 << 16
+
+    # Version of the layout of the directories written by `save`.
+    _MODEL_FORMAT = 1
+
     # Normalized identity (BGR gray) vector.
     _GRAY_UNIT = np.array([1, 1, 1]) / norm(np.array([1, 1, 1]))
 
@@ -141,4 +398,10 @@ class Name(Task):
             'classifier.class': None,
             'classifier.args': {},
             'classifier.scale': True,
+
+            'lut': False,
+            'lut.step': 4,
+            'lut.path': None,
+
+            'model': None,
         }
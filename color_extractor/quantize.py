@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def grid_size(step):
+    """
+    Return the number of cells along each axis of an RGB cube whose channels
+    are quantized in buckets of `step` values.
+    """
+    return -(-256 // step)
+
+
+def cell_centers(step, start=0, stop=None):
+    """
+    Return the color at the center of every cell of the RGB cube quantized
+    with `step`, as an array of shape `(n_cells, 3)` in the `[0, 255]` range.
+    Cells are ordered as the indices returned by `cell_index`. Only the cells
+    whose index is in `[start, stop)` are returned if given.
+    """
+    n = grid_size(step)
+    if stop is None:
+        stop = n ** 3
+
+    i = np.arange(start, stop)
+    q = np.stack((i // (n * n), i // n % n, i % n), axis=1)
+    return np.minimum(q * step + (step - 1) / 2., 255.)
+
+
+def cell_index(colors, step, scale=255.):
+    """
+    Return the flat index of the cell of the RGB cube quantized with `step`
+    containing each color of `colors`. The last axis of `colors` must hold
+    the three channels. Floating point colors are multiplied by `scale`
+    before being quantized, integer colors are expected in `[0, 255]`.
+    """
+    n = grid_size(step)
+    if colors.dtype.kind in 'ui':
+        q = colors.astype(np.intp) // step
+    else:
+        q = (colors * (scale / step)).astype(np.intp)
+
+    np.clip(q, 0, n - 1, out=q)
+    return (q[..., 0] * n + q[..., 1]) * n + q[..., 2]
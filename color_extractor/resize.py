@@ -1,5 +1,6 @@
 import numpy as np
 from skimage.transform import resize
+from skimage.util import img_as_float32, img_as_ubyte
 
 from .task import Task
 
@@ -23,6 +24,11 @@ class Resize(Task):
             - shape: The height of the resized image. The ratio between height
               and width is kept.
               (default: 100)
+
+            - precision: The type of the resized image, either 'float64' or
+              'float32' with values in `[0, 1]`, or 'uint8' with values in
+              `[0, 255]`. Smaller types use less memory down the pipeline.
+              (default: 'float64')
         """
         if settings is None:
             settings = {}
@@ -33,22 +39,43 @@ class Resize(Task):
         """Returns `img` cropped and resized."""
         return self._resize(self._crop(img))
 
+    def min_rows(self):
+        """
+        Return the smallest number of rows an image can have for its crop to
+        be resized without being upscaled.
+        """
+        return int(np.ceil(self._settings['rows'] / self._settings['crop']))
+
     def _resize(self, img):
         src_h, src_w = img.shape[:2]
         dst_h = self._settings['rows']
         dst_w = int((dst_h / src_h) * src_w)
-        return resize(img, (dst_h, dst_w))
+
+        p = self._settings['precision']
+        if p == 'float64':
+            return resize(img, (dst_h, dst_w))
+        elif p == 'float32':
+            img = resize(img_as_float32(img), (dst_h, dst_w))
+            return img.astype(np.float32, copy=False)
+        elif p == 'uint8':
+            # Resized in float32, as scikit-image would convert to float64.
+            img = resize(img_as_float32(img), (dst_h, dst_w))
+            return img_as_ubyte(np.clip(img, 0, 1))
+        else:
+            raise ValueError('Unknown precision {}'.format(p))
 
     def _crop(self, img):
         src_h, src_w = img.shape[:2]
         c = self._settings['crop']
         dst_h, dst_w = int(src_h * c), int(src_w * c)
         rm_h, rm_w = (src_h - dst_h) // 2, (src_w - dst_w) // 2
-        return img[rm_h:rm_h + dst_h, rm_w:rm_w + dst_w].copy()
+        # Resizing copies the image anyway.
+        return img[rm_h:rm_h + dst_h, rm_w:rm_w + dst_w]
 
     @staticmethod
     def _default_settings():
         return {
             'crop': 0.90,
             'rows': 100,
+            'precision': 'float64',
         }
@@ -0,0 +1,318 @@
+import json
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+
+from .from_file import FromFile
+from .task import Task
+
+
+class Service(Task):
+    def __init__(self, samples, labels, settings=None):
+        """
+        Serve the colors of images over HTTP, on a TCP port or on a Unix
+        socket. The pipeline is built once and the images of concurrent
+        requests are processed together by `ImageToColor.get_batch`.
+
+        `POST /colors` takes the bytes of an image, or a JSON object whose
+        'uri' is a path or URL to read the image from, and answers
+        `{"colors": [...]}`. `GET /health` answers whether the service can
+        process images and `GET /stats` the number of requests, images and
+        batches processed along with latency percentiles. As paths are read
+        on behalf of clients, the service is meant to listen locally.
+
+        The possible settings are the ones of `FromFile`, except 'debug',
+        plus:
+            - batch.size: The maximum number of images processed together.
+              (default: 16)
+
+            - batch.window: The number of seconds to wait for more images
+              once one is received, before processing the batch.
+              (default: 0.005)
+
+            - max_pending: The maximum number of images waiting for a batch.
+              Requests are answered with a 503 error beyond it.
+              (default: 256)
+        """
+        if settings is None:
+            settings = {}
+
+        super(Service, self).__init__(settings)
+        self._settings['debug'] = None
+        self._from_file = FromFile(samples, labels, self._settings)
+        self._image_to_color = self._from_file._image_to_color
+
+        self._queue = queue.Queue(self._settings['max_pending'])
+        self._server = None
+        self._threads = []
+
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._latencies = deque(maxlen=Service._LATENCIES)
+        self._counts = dict.fromkeys(('requests', 'errors', 'rejected',
+                                      'images', 'batches'), 0)
+
+    # Requests whose latency is kept for the stats.
+    _LATENCIES = 10000
+
+    def submit(self, img):
+        """
+        Queue `img` for the next batch and return a
+        `concurrent.futures.Future` of its colors. Raise `queue.Full` if
+        'max_pending' images are already waiting.
+        """
+        f = Future()
+        self._queue.put_nowait((img, f))
+        return f
+
+    def start(self, address):
+        """
+        Start serving on `address`, a `(host, port)` tuple or the path of a
+        Unix socket, from background threads. Return the address actually
+        listened on, the port being chosen by the system if `0`.
+        """
+        if isinstance(address, str):
+            self._server = _UnixServer(address, _Handler)
+        else:
+            self._server = _TCPServer(address, _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+
+        self._threads = [
+            threading.Thread(target=self._batches, name='batches'),
+            threading.Thread(target=self._server.serve_forever,
+                             name='server'),
+        ]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+        return self._server.server_address
+
+    def serve(self, address):
+        """Serve on `address` until interrupted, see `start`"""
+        self.start(address)
+        try:
+            while self._threads[0].is_alive():
+                self._threads[0].join(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop serving, once the images already received are processed"""
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._queue.put((None, None))
+        for t in self._threads:
+            t.join()
+        self._server = None
+
+    def healthy(self):
+        """Whether images are being processed"""
+        return bool(self._threads) and self._threads[0].is_alive()
+
+    def stats(self):
+        """
+        Return the number of requests, errors, rejected requests, images and
+        batches so far, the mean batch size, the throughput in images per
+        second since the start, the images waiting and the 50th, 95th and
+        99th percentiles of the latency of the last requests in seconds.
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            latencies = list(self._latencies)
+
+        uptime = time.time() - self._start
+        stats['uptime'] = uptime
+        stats['pending'] = self._queue.qsize()
+        stats['batch_size'] = stats['images'] / max(stats['batches'], 1)
+        stats['throughput'] = stats['images'] / uptime
+        p = np.percentile(latencies, (50, 95, 99)) if latencies else [0.] * 3
+        stats.update({'latency.p{}'.format(q): float(v)
+                      for q, v in zip((50, 95, 99), p)})
+        return stats
+
+    def _read(self, body, json_body):
+        """
+        Return the image sent in the body of a request, or read from the
+        'uri' of its JSON body. Raise `ValueError` if it can't be read.
+        """
+        try:
+            if json_body:
+                return self._from_file._read(json.loads(body)['uri'])
+            return self._from_file._read('', body)
+        except Exception as e:
+            raise ValueError('Unable to read image: {}'.format(e))
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _batches(self):
+        """Process the queued images in batches until `close`"""
+        size = self._settings['batch.size']
+        window = self._settings['batch.window']
+
+        while True:
+            batch = [self._queue.get()]
+            if batch[0][1] is None:
+                return
+
+            deadline = time.perf_counter() + window
+            while len(batch) < size:
+                try:
+                    item = self._queue.get(
+                        timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item[1] is None:
+                    self._queue.put(item)
+                    break
+                batch.append(item)
+
+            self._process(batch)
+
+    def _process(self, batch):
+        imgs = [i for i, _ in batch]
+        try:
+            results = self._image_to_color.get_batch(imgs, errors=True)
+        except Exception:
+            # A whole stack failed, find out which images did.
+            results = []
+            for i in imgs:
+                try:
+                    results.append(self._image_to_color.get(i))
+                except Exception as e:
+                    results.append(e)
+
+        with self._lock:
+            self._counts['batches'] += 1
+            self._counts['images'] += len(batch)
+
+        for (_, f), r in zip(batch, results):
+            if isinstance(r, Exception):
+                f.set_exception(r)
+            else:
+                f.set_result(r)
+
+    @staticmethod
+    def _default_settings():
+        return dict(FromFile._default_settings(), **{
+            'batch.size': 16,
+            'batch.window': 0.005,
+            'max_pending': 256,
+        })
+
+
+class _TCPServer(ThreadingHTTPServer):
+    # Let many clients connect at once.
+    request_queue_size = 128
+
+
+class _UnixServer(ThreadingMixIn, UnixStreamServer):
+    request_queue_size = 128
+
+    def server_bind(self):
+        # Remove the socket left by a previous run, but not a live one nor
+        # anything else found at its path.
+        path = self.server_address
+        s = socket.socket(socket.AF_UNIX)
+        try:
+            s.connect(path)
+        except ConnectionRefusedError:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise ValueError('Unable to listen on {}, it exists and is '
+                                 'not a socket'.format(path))
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        finally:
+            s.close()
+        super(_UnixServer, self).server_bind()
+        self._bound = True
+
+    def server_close(self):
+        super(_UnixServer, self).server_close()
+        # Also called when binding failed, the path is not ours then.
+        if getattr(self, '_bound', False):
+            self._bound = False
+            try:
+                os.unlink(self.server_address)
+            except FileNotFoundError:
+                pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            ok = service.healthy()
+            self._send(200 if ok else 503,
+                       {'status': 'ok' if ok else 'stopped'})
+        elif self.path == '/stats':
+            self._send(200, service.stats())
+        else:
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/colors':
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+
+        start = time.perf_counter()
+        service._count('requests')
+        json_body = self.headers.get('Content-Type', '').startswith(
+            'application/json')
+        try:
+            img = service._read(body, json_body)
+        except ValueError as e:
+            service._count('errors')
+            self._send(400, {'error': str(e)})
+            return
+
+        try:
+            colors = service.submit(img).result()
+        except queue.Full:
+            service._count('rejected')
+            self._send(503, {'error': 'Too many pending images'})
+            return
+        except Exception as e:
+            service._count('errors')
+            self._send(500, {'error': 'Unable to find colors: {}'.format(e)})
+            return
+
+        service._latency(time.perf_counter() - start)
+        self._send(200, {'colors': colors})
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
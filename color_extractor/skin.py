@@ -1,9 +1,9 @@
 import numpy as np
 import skimage.morphology as skm
-from skimage.filters import gaussian
 from skimage.color import rgb2hsv
 from skimage.util import img_as_float
 
+from .quantize import cell_centers, cell_index
 from .task import Task
 
 
@@ -14,43 +14,90 @@ class Skin(Task):
 
         The possible settings are:
             - skin_type: The type of skin most expected in the given images.
-              The value can be 'general' or 'none'. If 'none' is given the
-              an empty mask is returned.
+              The value can be one of the keys of `Skin.PRESETS` or 'none'.
+              If 'none' is given the an empty mask is returned.
               (default: 'general')
+
+            - lut: Test once whether the center of every cell of a quantized
+              RGB cube is in the range of the skin type, and look the pixels
+              up in this table instead of converting them to HSV.
+              (default: False)
+
+            - lut.step: The width of the cells of the lookup table along each
+              channel, in the `[0, 255]` range.
+              (default: 4)
         """
         if settings is None:
             settings = {}
 
         super(Skin, self).__init__(settings)
-        self._k = skm.disk(1, np.bool)
+        self._k = skm.disk(1, np.bool_)
 
         t = self._settings['skin_type']
-        if t == 'general':
-            self._lo = np.array([0, 0.19, 0.31], np.float64)
-            self._up = np.array([0.1, 1., 1.], np.float64)
-        elif t != 'none':
-            raise NotImplementedError('Only general type is implemented')
+        if t != 'none':
+            if t not in Skin.PRESETS:
+                raise NotImplementedError('Unknown skin type {}'.format(t))
+            lo, up = Skin.PRESETS[t]
+            self._lo = np.array(lo, np.float64)
+            self._up = np.array(up, np.float64)
+
+        self._lut = None
+        if t != 'none' and self._settings['lut']:
+            self._lut = self._build_lut(self._settings['lut.step'])
+
+    # Ranges of HSV colors of each skin type, lower and upper bounds
+    # included.
+    PRESETS = {
+        'general': ((0, 0.19, 0.31), (0.1, 1., 1.)),
+    }
 
     def get(self, img):
-        t = self._settings['skin_type']
-        if t == 'general':
-            img = rgb2hsv(img)
-        elif t == 'none':
-            return np.zeros(img.shape[:2], np.bool)
+        if self._settings['skin_type'] == 'none':
+            return np.zeros(img.shape[:-1], np.bool_)
+
+        if self._lut is not None:
+            mask = self._lut[cell_index(img, self._settings['lut.step'])]
         else:
-            raise NotImplementedError('Only general type is implemented')
+            mask = self._in_range(self._per_pixel(rgb2hsv, img))
+
+        return self._smooth(mask)
+
+    def get_batch(self, imgs):
+        """
+        Compute the skin masks of a stack of images of shape `(n, h, w, 3)`
+        at once.
+        """
+        return self.get(imgs)
+
+    def _in_range(self, hsv):
+        return np.all((hsv >= self._lo) & (hsv <= self._up), axis=-1)
+
+    def _build_lut(self, step):
+        """Return whether the center of each cell is in the skin range"""
+        rgb = cell_centers(step)[np.newaxis] / 255.
+        return self._in_range(rgb2hsv(rgb))[0]
+
+    # Blurring the mask with a gaussian of sigma 0.8 along rows, truncated
+    # at 4 sigmas, and keeping all non-zero pixels extends it of 3 pixels up
+    # and down. The mask is extended directly instead.
+    _SPREAD = 3
 
-        return self._range_mask(img)
+    def _smooth(self, mask):
+        # Smooth the mask, only along rows and columns for stacks of images.
+        k = self._k if mask.ndim == 2 else self._k[np.newaxis]
+        skm.binary_opening(mask, k, out=mask)
 
-    def _range_mask(self, img):
-        mask = np.all((img >= self._lo) & (img <= self._up), axis=2)
+        out = mask.copy()
+        for s in range(1, Skin._SPREAD + 1):
+            out[..., s:, :] |= mask[..., :-s, :]
+            out[..., :-s, :] |= mask[..., s:, :]
 
-        # Smooth the mask.
-        skm.binary_opening(mask, selem=self._k, out=mask)
-        return gaussian(mask, 0.8, multichannel=True) != 0
+        return out
 
     @staticmethod
     def _default_settings():
         return {
             'skin_type': 'general',
+            'lut': False,
+            'lut.step': 4,
         }
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Task(object):
     def __init__(self, settings):
         self._settings = self._default_settings()
@@ -6,6 +9,24 @@ class Task(object):
     def get(self, img):
         raise NotImplementedError
 
+    def get_batch(self, imgs):
+        """
+        Process a stack of images of the same shape at once. Tasks able to
+        process several images together override this method.
+        """
+        return np.stack([self.get(i) for i in imgs])
+
+    @staticmethod
+    def _per_pixel(conversion, img):
+        """
+        Apply the color `conversion` to `img`, a single image or a stack of
+        images, by viewing stacks as one tall image.
+        """
+        if img.ndim == 3:
+            return conversion(img)
+        return conversion(img.reshape((-1,) + img.shape[2:])).reshape(
+            img.shape)
+
     @staticmethod
     def _default_settings():
         return {}
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class Record(object):
+    """
+    Measurements made while processing an image: the wall time of each
+    stage, stored in seconds under 'time.<stage>', and other values such as
+    the number of pixels left after masking.
+    """
+    def __init__(self):
+        self.values = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        """Count the time elapsed since the previous lap as `stage` time"""
+        now = time.perf_counter()
+        key = 'time.' + stage
+        self.values[key] = self.values.get(key, 0.) + now - self._last
+        self._last = now
+
+    def restart(self):
+        """Don't count the time elapsed since the previous lap"""
+        self._last = time.perf_counter()
+
+    def add(self, key, value):
+        """Add `value` to the value stored under `key`"""
+        self.values[key] = self.values.get(key, 0) + value
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+
+class _NullRecord(object):
+    """Record ignoring everything, used when profiling is disabled"""
+    def lap(self, stage):
+        pass
+
+    def restart(self):
+        pass
+
+    def add(self, key, value):
+        pass
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_RECORD = _NullRecord()
+
+
+def new_record(collector):
+    """Return a record to be given to `collector`, if any"""
+    return _NULL_RECORD if collector is None else Record()
+
+
+def emit(collector, record):
+    if collector is not None:
+        collector.add(record.values)
+
+
+class Histogram(object):
+    """
+    Collector keeping all values in memory to report their percentiles.
+    """
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, values):
+        with self._lock:
+            for k, v in values.items():
+                self._values.setdefault(k, []).append(v)
+
+    def percentiles(self, q=(50, 95, 99)):
+        """Return the percentiles `q` of each value"""
+        with self._lock:
+            return {k: np.percentile(v, q) for k, v in self._values.items()}
+
+    def report(self, q=(50, 95, 99)):
+        """Return a table of the percentiles of each value. Times are in ms."""
+        header = ['{:<16}'.format('')] + ['{:>10}'.format('p{}'.format(p))
+                                          for p in q]
+        lines = [''.join(header + ['{:>10}'.format('count')])]
+        with self._lock:
+            counts = {k: len(v) for k, v in self._values.items()}
+
+        for k, p in sorted(self.percentiles(q).items()):
+            name = k
+            if k.startswith('time.'):
+                name, p = k[len('time.'):] + ' (ms)', p * 1000
+            cells = ['{:<16}'.format(name)]
+            cells += ['{:>10.1f}'.format(v) for v in p]
+            lines.append(''.join(cells + ['{:>10}'.format(counts[k])]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLines(object):
+    """Collector writing each record as a JSON line to `handle`"""
+    def __init__(self, handle):
+        self._handle = handle
+        self._lock = threading.Lock()
+
+    def add(self, values):
+        line = json.dumps(values) + '\n'
+        with self._lock:
+            self._handle.write(line)
+
+
+class Callback(object):
+    """Collector calling `callback` with the values of each record"""
+    def __init__(self, callback):
+        self._callback = callback
+
+    def add(self, values):
+        self._callback(values)